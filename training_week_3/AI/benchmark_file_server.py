@@ -0,0 +1,263 @@
+# benchmark_file_server.py
+"""Бенчмарк инструментов file_server.py на синтетическом дереве файлов.
+
+Пример:
+    python benchmark_file_server.py --files 2000 --depth 3 --output bench.json
+    python benchmark_file_server.py --transport stdio --iterations 20
+    python benchmark_file_server.py --startup-runs 10 --iterations 0
+
+Результат — JSON с p50/p99 задержкой, пропускной способностью и пиковым
+RSS для каждого инструмента, чтобы запуски можно было сравнивать.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # На Windows модуля resource нет — пиковый RSS не измеряется
+    resource = None
+
+ASCII_WORDS = ["python", "server", "index", "search", "file", "agent", "token", "cache"]
+CYRILLIC_WORDS = ["привет", "мир", "файл", "поиск", "сервер", "агент", "индекс", "кэш"]
+EXTENSIONS = [".txt", ".py", ".md", ".json"]
+
+
+def generate_corpus(root, files=1000, depth=3, fanout=4, mean_size=4096,
+                    cyrillic_ratio=0.3, seed=42):
+    """Создать воспроизводимое дерево файлов; вернуть список путей.
+
+    Размеры файлов распределены логнормально вокруг mean_size,
+    доля кириллических слов — cyrillic_ratio.
+    """
+    rng = random.Random(seed)
+    directories = [root]
+    frontier = [root]
+    for level in range(depth):
+        next_frontier = []
+        for parent in frontier:
+            for i in range(fanout):
+                path = os.path.join(parent, f"d{level}_{i}")
+                os.makedirs(path, exist_ok=True)
+                next_frontier.append(path)
+        directories.extend(next_frontier)
+        frontier = next_frontier
+
+    paths = []
+    for n in range(files):
+        directory = rng.choice(directories)
+        path = os.path.join(directory, f"f{n}{rng.choice(EXTENSIONS)}")
+        size = max(16, int(rng.lognormvariate(0, 1) * mean_size))
+        words = []
+        length = 0
+        while length < size:
+            pool = CYRILLIC_WORDS if rng.random() < cyrillic_ratio else ASCII_WORDS
+            word = rng.choice(pool)
+            words.append(word)
+            length += len(word.encode('utf-8')) + 1
+            if len(words) % 12 == 0:
+                words.append("\n")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(" ".join(words))
+        paths.append(path)
+    return paths
+
+
+def summarize(latencies, elapsed):
+    """p50/p99/среднее в миллисекундах и число вызовов в секунду"""
+    ordered = sorted(latencies)
+
+    def percentile(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        "calls": len(ordered),
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "throughput_per_s": round(len(ordered) / elapsed, 2) if elapsed else None,
+    }
+
+
+def peak_rss_kb(who="self"):
+    """Пиковый RSS процесса (или дочерних процессов) в килобайтах"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # На macOS ru_maxrss в байтах, на Linux — в килобайтах
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+
+
+def build_scenarios(root, paths, out_dir, iterations, seed):
+    """Список (имя, инструмент, аргументы) для каждого замера"""
+    rng = random.Random(seed)
+    scenarios = []
+    for _ in range(iterations):
+        scenarios.append(("list_files", "list_files", {"directory": root}))
+        scenarios.append(("list_files_recursive", "list_files",
+                          {"directory": root, "depth": -1, "limit": 500}))
+        scenarios.append(("read_file", "read_file", {"filepath": rng.choice(paths)}))
+        scenarios.append(("create_file", "create_file", {
+            "filepath": os.path.join(out_dir, f"out{rng.randrange(100)}.txt"),
+            "content": "привет мир\n" * 100,
+            "mode": "atomic",
+        }))
+        scenarios.append(("search_in_files", "search_in_files",
+                          {"directory": root, "search_term": rng.choice(ASCII_WORDS + CYRILLIC_WORDS)}))
+    # Поиск без индекса дорогой — меряем реже
+    for _ in range(max(1, iterations // 5) if iterations else 0):
+        scenarios.append(("search_in_files_scan", "search_in_files",
+                          {"directory": root, "search_term": rng.choice(CYRILLIC_WORDS),
+                           "use_index": False}))
+    return scenarios
+
+
+def collect(timings, started):
+    return {name: summarize(values, started[name]) for name, values in timings.items()}
+
+
+def run_inprocess(scenarios):
+    """Вызов синхронных тел инструментов прямо в этом процессе"""
+    import file_server
+
+    timings, elapsed = {}, {}
+    cold = {}
+    for name, tool, arguments in scenarios:
+        func = getattr(file_server, tool).__wrapped__
+        start = time.perf_counter()
+        func(**arguments)
+        duration = time.perf_counter() - start
+        if name not in timings and name.startswith("search"):
+            # Первый поиск строит индекс — его показываем отдельно
+            cold[name] = round(duration * 1000, 3)
+        timings.setdefault(name, []).append(duration)
+        elapsed[name] = elapsed.get(name, 0) + duration
+    return {"tools": collect(timings, elapsed), "cold_ms": cold, "peak_rss_kb": peak_rss_kb()}
+
+
+async def run_stdio(scenarios, env):
+    """Те же вызовы через stdio-транспорт MCP, как их делает агент"""
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    server_params = StdioServerParameters(
+        command=sys.executable,
+        args=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "file_server.py")],
+        env=env,
+    )
+    timings, elapsed = {}, {}
+    start = time.perf_counter()
+    async with stdio_client(server_params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            await session.list_tools()
+            startup = time.perf_counter() - start
+            for name, tool, arguments in scenarios:
+                start = time.perf_counter()
+                await session.call_tool(tool, arguments)
+                duration = time.perf_counter() - start
+                timings.setdefault(name, []).append(duration)
+                elapsed[name] = elapsed.get(name, 0) + duration
+    return {
+        "tools": collect(timings, elapsed),
+        "startup_ms": round(startup * 1000, 3),
+        "server_peak_rss_kb": peak_rss_kb("children"),
+    }
+
+
+def measure_startup(script, runs, env):
+    """Время от запуска процесса сервера до ответа на tools/list.
+
+    Разговор идёт сырыми строками JSON-RPC, без библиотеки mcp, чтобы
+    клиент не добавлял к замеру своё время импорта.
+    """
+    handshake = b"".join((json.dumps(message) + "\n").encode('utf-8') for message in (
+        {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {
+            "protocolVersion": "2024-11-05", "capabilities": {},
+            "clientInfo": {"name": "benchmark", "version": "0"}}},
+        {"jsonrpc": "2.0", "method": "notifications/initialized"},
+        {"jsonrpc": "2.0", "id": 2, "method": "tools/list"},
+    ))
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, path], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+        try:
+            proc.stdin.write(handshake)
+            proc.stdin.flush()
+            for line in proc.stdout:
+                if json.loads(line).get("id") == 2:
+                    break
+            else:
+                return {"error": "сервер завершился, не ответив на tools/list"}
+            durations.append(time.perf_counter() - start)
+        finally:
+            proc.kill()
+            proc.wait()
+    return summarize(durations, sum(durations))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк инструментов file_server.py")
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--mean-size", type=int, default=4096)
+    parser.add_argument("--cyrillic-ratio", type=float, default=0.3)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--transport", choices=["inprocess", "stdio", "both"], default="inprocess")
+    parser.add_argument("--startup-runs", type=int, default=0,
+                        help="сколько раз замерить запуск до ответа на tools/list")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="file_server_bench_") as workdir:
+        root = os.path.join(workdir, "corpus")
+        out_dir = os.path.join(workdir, "out")
+        os.makedirs(root)
+        os.makedirs(out_dir)
+        # Индекс в отдельном каталоге, чтобы не трогать кэш пользователя
+        os.environ["FILE_SERVER_INDEX_DIR"] = os.path.join(workdir, "index")
+
+        start = time.perf_counter()
+        paths = generate_corpus(root, args.files, args.depth, args.fanout,
+                                args.mean_size, args.cyrillic_ratio, args.seed)
+        report = {
+            "config": vars(args),
+            "corpus": {
+                "files": len(paths),
+                "bytes": sum(os.path.getsize(p) for p in paths),
+                "generate_ms": round((time.perf_counter() - start) * 1000, 3),
+            },
+        }
+        scenarios = build_scenarios(root, paths, out_dir, args.iterations, args.seed)
+        if args.startup_runs:
+            report["startup"] = {
+                script: measure_startup(script, args.startup_runs, dict(os.environ))
+                for script in ("file_server.py", "file_daemon.py")
+            }
+        if scenarios and args.transport in ("inprocess", "both"):
+            report["inprocess"] = run_inprocess(scenarios)
+        if scenarios and args.transport in ("stdio", "both"):
+            report["stdio"] = asyncio.run(run_stdio(scenarios, dict(os.environ)))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# file_cache.py
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from file_stats import stats
+
+# Бюджет кэша чтения в байтах
+CACHE_BYTES = int(os.environ.get("FILE_SERVER_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+class ReadCache:
+    """LRU-кэш содержимого файлов с ограничением по памяти.
+
+    Запись действительна, пока у файла не изменились (size, mtime_ns):
+    повторное чтение стоит один stat. Файлы крупнее 1/8 бюджета
+    не кэшируются, чтобы один большой файл не вытеснил всё остальное.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # абсолютный путь -> (key, text, cost)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def read_text(self, filepath):
+        """Содержимое файла в UTF-8 — из кэша, если файл не менялся"""
+        st = os.stat(filepath)
+        key = (st.st_size, st.st_mtime_ns)
+        path = os.path.abspath(filepath)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with stats.phase("read"):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                text = f.read()
+        stats.add_io(st.st_size)
+        self._store(path, key, text)
+        return text
+
+    def _store(self, path, key, text):
+        cost = sys.getsizeof(text)
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= old[2]
+            if cost > self.max_bytes // 8:
+                return
+            self.entries[path] = (key, text, cost)
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, (_, _, evicted_cost) = self.entries.popitem(last=False)
+                self.size -= evicted_cost
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,398 @@
+# file_daemon.py
+"""Быстрый запуск файлового сервера.
+
+    python file_daemon.py                  # stdio-сервер MCP для агента
+    python file_daemon.py --serve          # постоянный демон на локальном сокете
+    python file_daemon.py --build-schema   # пересобрать схему инструментов
+
+Stdio-часть отвечает на initialize и tools/list по заранее собранной
+схеме инструментов, не импортируя fastmcp, asyncio и file_server.
+Вызовы инструментов уходят демону через сокет FILE_SERVER_SOCKET,
+а если демон не запущен — в file_server, который импортируется
+в фоне сразу после ответа на tools/list.
+"""
+import os
+import sys
+import json
+import threading
+
+SERVER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "file_server.py")
+
+# Тот же каталог, что INDEX_DIR в file_index.py (модуль не импортируем ради скорости)
+CACHE_DIR = os.environ.get(
+    "FILE_SERVER_INDEX_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "simple_file_server")
+)
+SCHEMA_FILE = os.path.join(CACHE_DIR, "tool_schema.json")
+SOCKET_PATH = os.environ.get("FILE_SERVER_SOCKET", os.path.join(CACHE_DIR, "server.sock"))
+
+PROTOCOL_VERSION = "2024-11-05"
+SERVER_INFO = {"name": "Simple File Server", "version": "0.1.0"}
+
+# Аннотации параметров инструментов -> типы JSON Schema
+JSON_TYPES = {
+    "str": "string", "int": "integer", "float": "number",
+    "bool": "boolean", "list": "array", "dict": "object",
+}
+
+
+def _is_tool_decorator(node):
+    """@mcp.tool() или @blocking_tool("группа")"""
+    import ast
+
+    if not isinstance(node, ast.Call):
+        return False
+    func = node.func
+    return getattr(func, "id", None) == "blocking_tool" or getattr(func, "attr", None) == "tool"
+
+
+def _tool_schema(node):
+    import ast
+
+    args = node.args.args
+    defaults = [None] * (len(args) - len(node.args.defaults)) + node.args.defaults
+    properties, required = {}, []
+    for arg, default in zip(args, defaults):
+        prop = {}
+        if isinstance(arg.annotation, ast.Name) and arg.annotation.id in JSON_TYPES:
+            prop["type"] = JSON_TYPES[arg.annotation.id]
+        if default is None:
+            required.append(arg.arg)
+        else:
+            try:
+                value = ast.literal_eval(default)
+            except ValueError:
+                # Значение по умолчанию — константа модуля (PAGE_SIZE):
+                # параметр необязательный, но значение в схему не попадает
+                value = None
+            if value is not None:
+                prop["default"] = value
+        properties[arg.arg] = prop
+    return {
+        "name": node.name,
+        "description": ast.get_docstring(node) or "",
+        "inputSchema": {"type": "object", "properties": properties, "required": required},
+    }
+
+
+def build_schema(source=SERVER_FILE):
+    """Схема инструментов file_server.py, собранная по исходнику без его импорта"""
+    import ast
+
+    with open(source, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    return [
+        _tool_schema(node) for node in tree.body
+        if isinstance(node, ast.FunctionDef) and any(map(_is_tool_decorator, node.decorator_list))
+    ]
+
+
+def load_schema(rebuild=False):
+    """Схема из кэша; пересобирается, если file_server.py изменился"""
+    st = os.stat(SERVER_FILE)
+    key = [st.st_size, st.st_mtime_ns]
+    if not rebuild:
+        try:
+            with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                return cached["tools"]
+        except (OSError, ValueError, KeyError):
+            pass
+    tools = build_schema()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = SCHEMA_FILE + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "tools": tools}, f, ensure_ascii=False)
+        os.replace(tmp_path, SCHEMA_FILE)
+    except OSError:
+        pass
+    return tools
+
+
+async def call_tool(module, name, arguments):
+    """Вызвать инструмент модуля file_server (async-обёртку или обычную функцию)"""
+    result = getattr(module, name)(**arguments)
+    if hasattr(result, "__await__"):
+        result = await result
+    return result
+
+
+class InProcessBackend:
+    """Инструменты file_server, импортированного в этом же процессе.
+
+    Импорт и цикл событий запускаются в фоновом потоке, поэтому
+    ответы на initialize и tools/list их не ждут.
+    """
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.error = None
+        self.loop = None
+        self.module = None
+        self.calls = {}   # id запроса -> concurrent.futures.Future
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            import asyncio
+            import file_server
+            self.loop = asyncio.new_event_loop()
+            self.module = file_server
+        except Exception as e:
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        self.loop.run_forever()
+
+    def call(self, request_id, name, arguments, on_done):
+        """Запустить вызов; on_done(текст, ошибка ли) вызывается из другого потока"""
+        import asyncio
+
+        self.ready.wait()
+        if self.error is not None:
+            on_done(f"Ошибка запуска сервера: {self.error}", True)
+            return
+        future = asyncio.run_coroutine_threadsafe(call_tool(self.module, name, arguments), self.loop)
+        self.calls[request_id] = future
+
+        def finished(future):
+            self.calls.pop(request_id, None)
+            if future.cancelled():
+                # На отменённый запрос по протоколу MCP не отвечают
+                return
+            error = future.exception()
+            on_done(str(error) if error else future.result(), error is not None)
+
+        future.add_done_callback(finished)
+
+    def cancel(self, request_id):
+        future = self.calls.get(request_id)
+        if future is not None:
+            future.cancel()
+
+
+class DaemonBackend:
+    """Вызовы инструментов через постоянный демон на локальном сокете.
+
+    По сокету ходят строки JSON: {"id", "tool", "arguments", "cwd"} или
+    {"id", "cancel": true} к демону и {"id", "result"|"error"|"cancelled"}
+    обратно. Ответы приходят в порядке завершения вызовов. cwd — рабочая
+    директория агента: от неё демон считает относительные пути.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.pending = {}   # id запроса -> on_done
+        threading.Thread(target=self._read, daemon=True).start()
+
+    @classmethod
+    def connect(cls, path=SOCKET_PATH):
+        """Подключиться к демону; None, если он не запущен"""
+        if not os.path.exists(path):
+            return None
+        import socket
+
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+
+    def _send(self, message):
+        data = (json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8')
+        with self.lock:
+            self.sock.sendall(data)
+
+    def _read(self):
+        with self.sock.makefile('rb') as replies:
+            for line in replies:
+                reply = json.loads(line)
+                on_done = self.pending.pop(reply["id"], None)
+                if on_done is None or reply.get("cancelled"):
+                    continue
+                if "error" in reply:
+                    on_done(reply["error"], True)
+                else:
+                    on_done(reply["result"], False)
+        # Демон завершился — незавершённые вызовы получают ошибку
+        for on_done in list(self.pending.values()):
+            on_done("Ошибка: соединение с демоном закрыто", True)
+        self.pending.clear()
+
+    def call(self, request_id, name, arguments, on_done):
+        self.pending[request_id] = on_done
+        try:
+            self._send({"id": request_id, "tool": name, "arguments": arguments, "cwd": os.getcwd()})
+        except OSError as e:
+            self.pending.pop(request_id, None)
+            on_done(f"Ошибка: {str(e)}", True)
+
+    def cancel(self, request_id):
+        if request_id in self.pending:
+            try:
+                self._send({"id": request_id, "cancel": True})
+            except OSError:
+                pass
+
+
+def run_stdio():
+    """MCP по stdio: initialize, tools/list, tools/call, ping и отмена вызовов"""
+    tools = load_schema()
+    names = {tool["name"] for tool in tools}
+    out = sys.stdout.buffer
+    out_lock = threading.Lock()
+    backend = None
+
+    def send(message):
+        data = (json.dumps(dict(message, jsonrpc="2.0"), ensure_ascii=False) + "\n").encode('utf-8')
+        with out_lock:
+            out.write(data)
+            out.flush()
+
+    def get_backend():
+        nonlocal backend
+        if backend is None:
+            backend = DaemonBackend.connect() or InProcessBackend()
+        return backend
+
+    def reply_with(request_id):
+        def on_done(text, is_error):
+            send({"id": request_id, "result": {
+                "content": [{"type": "text", "text": text}],
+                "isError": is_error,
+            }})
+        return on_done
+
+    for line in sys.stdin.buffer:
+        if not line.strip():
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            send({"id": None, "error": {"code": -32700, "message": "Parse error"}})
+            continue
+        method = message.get("method")
+        request_id = message.get("id")
+        params = message.get("params") or {}
+
+        if method == "initialize":
+            send({"id": request_id, "result": {
+                "protocolVersion": params.get("protocolVersion", PROTOCOL_VERSION),
+                "capabilities": {"tools": {"listChanged": False}},
+                "serverInfo": SERVER_INFO,
+            }})
+        elif method == "tools/list":
+            send({"id": request_id, "result": {"tools": tools}})
+            # Вызовы почти наверняка последуют — поднимаем сервер, пока клиент
+            # разбирает список инструментов
+            get_backend()
+        elif method == "ping":
+            send({"id": request_id, "result": {}})
+        elif method == "tools/call":
+            name = params.get("name")
+            if name not in names:
+                send({"id": request_id, "error": {"code": -32602, "message": f"Unknown tool: {name}"}})
+                continue
+            get_backend().call(request_id, name, params.get("arguments") or {}, reply_with(request_id))
+        elif method == "notifications/cancelled":
+            if backend is not None:
+                backend.cancel(params.get("requestId"))
+        elif request_id is not None:
+            send({"id": request_id, "error": {"code": -32601, "message": f"Method not found: {method}"}})
+
+
+def serve(path=SOCKET_PATH):
+    """Постоянный демон: file_server загружается один раз, агенты подключаются через сокет.
+
+    Тёплые индексы и кэши общие для всех подключённых агентов, а формат
+    ответов (negotiate_encoding) у каждого соединения свой.
+    """
+    import asyncio
+    import signal
+    import file_server
+
+    names = {tool["name"] for tool in load_schema()}
+
+    async def handle(reader, writer):
+        # Соединение обслуживается своей задачей asyncio, и формат ответов,
+        # заведённый здесь, видят только вызовы этого агента
+        file_server.new_session()
+        tasks = {}
+
+        async def send(reply):
+            writer.write((json.dumps(reply, ensure_ascii=False) + "\n").encode('utf-8'))
+            await writer.drain()
+
+        async def run(message):
+            request_id = message["id"]
+            # Задача вызова работает в своей копии контекста — cwd видит только она
+            file_server.set_client_cwd(message["cwd"])
+            try:
+                reply = {"id": request_id,
+                         "result": await call_tool(file_server, message["tool"], message.get("arguments") or {})}
+            except asyncio.CancelledError:
+                reply = {"id": request_id, "cancelled": True}
+            except Exception as e:
+                reply = {"id": request_id, "error": f"Ошибка: {str(e)}"}
+            finally:
+                tasks.pop(request_id, None)
+            await send(reply)
+
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message.get("cancel"):
+                    task = tasks.get(message["id"])
+                    if task is not None:
+                        task.cancel()
+                elif message.get("tool") not in names:
+                    await send({"id": message["id"], "error": f"Ошибка: неизвестный инструмент {message.get('tool')}"})
+                elif not os.path.isabs(message.get("cwd") or ""):
+                    # Без неё относительные пути разрешились бы от директории демона
+                    await send({"id": message["id"], "error": "Ошибка: не передана рабочая директория клиента"})
+                else:
+                    tasks[message["id"]] = asyncio.create_task(run(message))
+        except asyncio.CancelledError:
+            # Демон останавливается при подключённых агентах
+            pass
+        finally:
+            # Агент отключился — его незавершённые вызовы больше не нужны
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+    async def main():
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(handle, path)
+        os.chmod(path, 0o600)
+        print(f"Демон файлового сервера слушает {path}", file=sys.stderr)
+        stop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        serve()
+    elif "--build-schema" in sys.argv:
+        print(f"Инструментов в схеме: {len(load_schema(rebuild=True))}")
+    else:
+        run_stdio()
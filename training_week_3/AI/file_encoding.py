@@ -0,0 +1,103 @@
+# file_encoding.py
+import base64
+import gzip
+import json
+
+try:
+    # Необязательная зависимость: zstd сжимает быстрее и лучше gzip
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Возможности компактного кодирования ответов:
+# compact — JSON без отступов, columnar — листинги столбцами,
+# gzip/zstd — сжатие больших тел файлов с base64
+FEATURES = ("compact", "columnar", "gzip") + (("zstd",) if zstandard is not None else ())
+
+# Тела файлов меньше порога не сжимаются: выигрыш не окупает base64
+COMPRESS_THRESHOLD = 64 * 1024
+
+# Инструменты, в ответах которых есть тела файлов
+BODY_TOOLS = ("read_file", "read_many", "read_file_chunk")
+
+
+class ResponseEncoding:
+    """Формат ответов, согласованный с клиентом.
+
+    По умолчанию ничего не включено, и ответы совпадают с прежними,
+    поэтому клиенты, которые не вызывают negotiate(), работают как раньше.
+    """
+
+    def __init__(self):
+        self.features = set()
+
+    def negotiate(self, accept):
+        """Включить те из предложенных клиентом возможностей, что поддерживаются"""
+        self.features = {feature for feature in accept if feature in FEATURES}
+        return sorted(self.features)
+
+    def dumps(self, obj, **kwargs):
+        """json.dumps; при compact — без отступов и \\u-экранирования"""
+        if "compact" in self.features:
+            kwargs.pop("indent", None)
+            kwargs["separators"] = (',', ':')
+            kwargs["ensure_ascii"] = False
+        return json.dumps(obj, **kwargs)
+
+    def listing(self, files):
+        """Список словарей -> столбцы {"name": [...], ...} при columnar"""
+        if "columnar" not in self.features or not files:
+            return files
+        return {key: [item[key] for item in files] for key in files[0]}
+
+    def compression(self):
+        if "zstd" in self.features:
+            return "zstd"
+        if "gzip" in self.features:
+            return "gzip"
+        return None
+
+    def body(self, text):
+        """Тело файла: как есть или {"encoding", "data"} для больших файлов"""
+        method = self.compression()
+        if method is None or len(text) < COMPRESS_THRESHOLD:
+            return text
+        raw = text.encode('utf-8')
+        if method == "zstd":
+            packed = zstandard.ZstdCompressor(level=3).compress(raw)
+        else:
+            packed = gzip.compress(raw, compresslevel=6)
+        return {"encoding": f"{method}+base64", "data": base64.b64encode(packed).decode('ascii')}
+
+
+def decode_body(value):
+    """Обратное к ResponseEncoding.body(): вернуть текст"""
+    if not isinstance(value, dict) or "encoding" not in value:
+        return value
+    packed = base64.b64decode(value["data"])
+    if value["encoding"] == "zstd+base64":
+        raw = zstandard.ZstdDecompressor().decompress(packed)
+    elif value["encoding"] == "gzip+base64":
+        raw = gzip.decompress(packed)
+    else:
+        raise ValueError(f"неизвестное кодирование {value['encoding']}")
+    return raw.decode('utf-8')
+
+
+def decode_response(tool, text, features):
+    """Развернуть сжатые тела в ответе инструмента tool (для клиента).
+
+    features — возможности, включённые negotiate_encoding. Формат ответа
+    определяется по инструменту, а не по содержимому: без сжатия ответ
+    не меняется, а со сжатием read_file всегда отвечает {"content": тело},
+    read_many и read_file_chunk — объектами с полем "content".
+    """
+    if tool not in BODY_TOOLS or not {"gzip", "zstd"} & set(features) or text.startswith("Ошибка"):
+        return text
+    data = json.loads(text)
+    if tool == "read_file":
+        return decode_body(data["content"])
+    for item in data if isinstance(data, list) else [data]:
+        if isinstance(item.get("content"), dict):
+            item["content"] = decode_body(item["content"])
+    return json.dumps(data, ensure_ascii=False)
@@ -0,0 +1,382 @@
+# file_finder.py
+import os
+import re
+import bisect
+import heapq
+import threading
+from array import array
+from collections import Counter
+
+from file_ignore import EXCLUDES
+from file_index import COMPACT_MIN_DEAD, FileTracker, trigrams
+
+# Сколько кандидатов оценивать точной функцией там, где их нельзя
+# упорядочить дешевле (подстрока в пути, опечатки)
+MAX_CANDIDATES = 2000
+
+# При изменении большего числа путей список пересортировывается целиком
+RESORT_THRESHOLD = 1000
+
+
+def _subsequence_gaps(query, text):
+    """Сумма пропусков, если query — подпоследовательность text, иначе None"""
+    pos = -1
+    gaps = 0
+    for char in query:
+        found = text.find(char, pos + 1)
+        if found < 0:
+            return None
+        if pos >= 0:
+            gaps += found - pos - 1
+        pos = found
+    return gaps
+
+
+def fuzzy_score(query, path):
+    """Оценка пути для запроса в нижнем регистре: больше — лучше, 0 — не подходит.
+
+    Порядок предпочтений: точное имя файла, подстрока в имени,
+    подстрока в пути, подпоследовательность в имени, затем в пути,
+    и наконец доля общих триграмм (опечатки).
+    """
+    lower = path.lower().replace(os.sep, '/')
+    name = lower.rsplit('/', 1)[-1]
+    if name == query:
+        return 1000.0
+    pos = name.find(query)
+    if pos >= 0:
+        return 800.0 - pos - len(name) * 0.1
+    if query in lower:
+        return 600.0 - len(lower) * 0.1
+    gaps = _subsequence_gaps(query, name)
+    if gaps is not None:
+        return 400.0 - gaps - len(name) * 0.1
+    gaps = _subsequence_gaps(query, lower)
+    if gaps is not None:
+        return 200.0 - min(gaps, 150) - len(lower) * 0.01
+    query_grams = trigrams(query)
+    if not query_grams:
+        return 0.0
+    return 100.0 * len(query_grams & trigrams(lower)) / len(query_grams)
+
+
+def _name_score(query, name):
+    """fuzzy_score для пути по одному имени файла (в нижнем регистре) или 0.
+
+    Точное имя, подстрока и подпоследовательность в имени fuzzy_score
+    проверяет по имени, поэтому оценку достаточно посчитать раз на имя.
+    """
+    if name == query:
+        return 1000.0
+    pos = name.find(query)
+    if pos >= 0:
+        return 800.0 - pos - len(name) * 0.1
+    gaps = _subsequence_gaps(query, name)
+    if gaps is not None:
+        return 400.0 - gaps - len(name) * 0.1
+    return 0.0
+
+
+def _above(scores, threshold):
+    return sum(1 for score in scores.values() if score > threshold)
+
+
+def _append_ids(postings, grams, item_id):
+    """Добавить item_id в массивы postings для каждой триграммы"""
+    for gram in grams:
+        ids = postings.get(gram)
+        if ids is None:
+            postings[gram] = array('I', (item_id,))
+        else:
+            ids.append(item_id)
+
+
+class PathIndex:
+    """Индекс путей дерева в памяти для нечёткого поиска файлов по имени.
+
+    Путям выдаются целочисленные id, а для каждой триграммы пути хранится
+    компактный массив id (как в TrigramIndex): удалённые id отсеиваются
+    при выборке, массивы периодически уплотняются. Отдельно хранятся
+    различные имена файлов со своим триграммным индексом — оценка по имени
+    считается раз на имя, а не на каждый путь с ним. Поиск идёт по
+    ступеням fuzzy_score (подстрока в имени, в пути, подпоследовательность
+    в имени, опечатки или, без общих триграмм, подпоследовательность в пути)
+    и останавливается, как только следующая ступень уже
+    не может попасть в лучшие limit. Обновляется через FileTracker — тот же
+    обход с правилами игнорирования, что и у search_in_files, но по всем
+    файлам.
+    """
+
+    def __init__(self, root, use_inotify=True, excludes=EXCLUDES):
+        self.root = os.path.abspath(root)
+        self.tracker = FileTracker(self.root, use_inotify=use_inotify, extensions=None,
+                                   excludes=excludes)
+        self.paths = []       # id -> относительный путь (None — удалённый id)
+        self.ids = {}         # относительный путь -> id
+        self.order = []       # живые пути по алфавиту (поддиректория — отрезок)
+        self.postings = {}    # триграмма пути -> array('I') id путей
+        self.dead = 0         # сколько id в paths помечены удалёнными
+        self.name_ids = {}    # имя файла в нижнем регистре -> id имени
+        self.name_list = []   # id имени -> имя
+        self.name_files = []  # id имени -> array('I') id путей
+        self.name_grams = {}  # триграмма имени -> array('I') id имён
+        self._names_text = None   # все имена через перевод строки (для регулярных выражений)
+        self.lock = threading.RLock()   # обновление и поиск
+
+    @staticmethod
+    def _lower(path):
+        return path.lower().replace(os.sep, '/')
+
+    def refresh(self):
+        """Учесть изменения дерева с прошлого вызова"""
+        with self.lock:
+            changed, removed = self.tracker.changes()
+            for rel_path in removed:
+                self._remove(rel_path)
+            added = [rel_path for rel_path in changed if rel_path not in self.ids]
+            for rel_path in added:
+                self._add(rel_path)
+            if len(added) > RESORT_THRESHOLD:
+                self.order = sorted(self.ids)
+            else:
+                for rel_path in added:
+                    bisect.insort(self.order, rel_path)
+            if self.dead > max(len(self.ids), COMPACT_MIN_DEAD):
+                self.compact()
+
+    def _add(self, rel_path):
+        file_id = len(self.paths)
+        self.paths.append(rel_path)
+        self.ids[rel_path] = file_id
+        lower = self._lower(rel_path)
+        _append_ids(self.postings, trigrams(lower), file_id)
+        name = lower.rsplit('/', 1)[-1]
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.name_list)
+            self.name_list.append(name)
+            self.name_files.append(array('I'))
+            _append_ids(self.name_grams, trigrams(name), name_id)
+            self._names_text = None
+        self.name_files[name_id].append(file_id)
+
+    def _remove(self, rel_path):
+        file_id = self.ids.pop(rel_path, None)
+        if file_id is None:
+            return
+        self.paths[file_id] = None
+        self.dead += 1
+        pos = bisect.bisect_left(self.order, rel_path)
+        if pos < len(self.order) and self.order[pos] == rel_path:
+            del self.order[pos]
+
+    def compact(self):
+        """Убрать удалённые id из массивов, забыть имена без путей и перенумеровать"""
+        with self.lock:
+            remap = array('I', bytes(4 * len(self.paths)))
+            paths = []
+            for file_id, path in enumerate(self.paths):
+                if path is not None:
+                    remap[file_id] = len(paths)
+                    paths.append(path)
+
+            def live(file_ids):
+                return array('I', [remap[file_id] for file_id in file_ids
+                                   if self.paths[file_id] is not None])
+
+            for gram, file_ids in list(self.postings.items()):
+                file_ids = live(file_ids)
+                if file_ids:
+                    self.postings[gram] = file_ids
+                else:
+                    del self.postings[gram]
+            names = [(name, live(file_ids)) for name, file_ids in zip(self.name_list, self.name_files)]
+            names = [(name, file_ids) for name, file_ids in names if file_ids]
+            self.name_list = [name for name, _ in names]
+            self.name_files = [file_ids for _, file_ids in names]
+            self.name_ids = {name: name_id for name_id, name in enumerate(self.name_list)}
+            self.name_grams = {}
+            for name_id, name in enumerate(self.name_list):
+                _append_ids(self.name_grams, trigrams(name), name_id)
+            self.paths = paths
+            self.ids = {path: file_id for file_id, path in enumerate(paths)}
+            self.dead = 0
+            self._names_text = None
+
+    def _live(self, file_ids, prefix):
+        """Живые пути с такими id, начинающиеся с prefix"""
+        paths = self.paths
+        for file_id in file_ids:
+            path = paths[file_id]
+            if path is not None and path.startswith(prefix):
+                yield path
+
+    def _grep_names(self, pattern, limit=None):
+        """Имена с совпадением регулярного выражения (не больше limit):
+        список (id имени, длина первого совпадения в нём)"""
+        if self._names_text is None:
+            self._names_text = '\n'.join(self.name_list)
+        text = self._names_text
+        regex = re.compile(pattern)
+        found = []
+        pos = 0
+        while limit is None or len(found) < limit:
+            match = regex.search(text, pos)
+            if match is None:
+                break
+            start = text.rfind('\n', 0, match.start()) + 1
+            end = text.find('\n', match.end())
+            end = len(text) if end < 0 else end
+            # Имя с переводом строки внутри сюда не попадёт: оно разбито на две строки
+            name_id = self.name_ids.get(text[start:end])
+            if name_id is not None:
+                found.append((name_id, match.end() - match.start()))
+            pos = end + 1
+        return found
+
+    def _expand_names(self, ranked, prefix, limit, scores):
+        """Добавить пути имён из списка (оценка, id имени), от лучших,
+        пока не наберётся limit (вместе с равными по оценке)"""
+        ranked.sort(key=lambda item: (-item[0], self.name_list[item[1]]))
+        found = 0
+        cut = None
+        for score, name_id in ranked:
+            if score <= 0 or (found >= limit and score < cut):
+                break
+            for path in self._live(self.name_files[name_id], prefix):
+                if scores.get(path, 0) < score:
+                    scores[path] = score
+                found += 1
+            cut = score
+
+    def _match_name_substring(self, query, prefix, limit, scores):
+        """Ступень имени: точное имя и подстрока в имени (оценки от 800)"""
+        grams = trigrams(query)
+        if not grams:
+            # Короткий запрос: точное имя по словарю, подстроку — в первых
+            # MAX_CANDIDATES именах, где она есть
+            found = self._grep_names(re.escape(query), MAX_CANDIDATES) if query else []
+            name_ids = [name_id for name_id, _ in found]
+            exact = self.name_ids.get(query)
+            if exact is not None:
+                name_ids.append(exact)
+        else:
+            postings = sorted((self.name_grams.get(gram) for gram in grams), key=lambda ids: len(ids or ()))
+            if not postings[0]:
+                return
+            name_ids = set(postings[0])
+            for ids in postings[1:]:
+                name_ids.intersection_update(ids)
+            name_ids = [name_id for name_id in name_ids if query in self.name_list[name_id]]
+        ranked = [(_name_score(query, self.name_list[name_id]), name_id) for name_id in name_ids]
+        self._expand_names(ranked, prefix, limit, scores)
+
+    def _match_path_substring(self, query, prefix, scores):
+        """Ступень пути: подстрока в пути (оценки от 400 до 600)"""
+        grams = trigrams(query)
+        if not grams:
+            # Короткий запрос: просматриваем пути под prefix по порядку
+            # (они идут подряд), пока не наберётся MAX_CANDIDATES подходящих
+            found = 0
+            for pos in range(bisect.bisect_left(self.order, prefix), len(self.order)):
+                rel_path = self.order[pos]
+                if not rel_path.startswith(prefix):
+                    break
+                if query in self._lower(rel_path) and scores.get(rel_path, 0) < 600:
+                    scores[rel_path] = fuzzy_score(query, rel_path)
+                    found += 1
+                    if found >= MAX_CANDIDATES:
+                        break
+            return
+        postings = [self.postings.get(gram) for gram in grams]
+        if not all(postings):
+            return
+        postings.sort(key=len)
+        found = set(postings[0])
+        for file_ids in postings[1:]:
+            found.intersection_update(file_ids)
+            if not found:
+                return
+        candidates = self._live(found, prefix)
+        if len(found) > MAX_CANDIDATES:
+            # Оценка подстроки в пути убывает с его длиной: оцениваем самые короткие
+            candidates = heapq.nsmallest(MAX_CANDIDATES, candidates, key=len)
+        for rel_path in candidates:
+            # Пути с подстрокой в имени уже оценены точно
+            if scores.get(rel_path, 0) < 600:
+                score = fuzzy_score(query, rel_path)
+                if score > 0:
+                    scores[rel_path] = score
+
+    def _match_name_subsequence(self, query, prefix, limit, scores):
+        """Ступень подпоследовательности в имени (оценки до 400)"""
+        if not query:
+            return
+        # c[^f\n]*f — до первого вхождения следующего символа: без возвратов,
+        # один проход по имени; поиск сам перескакивает к первому символу запроса
+        chars = [re.escape(char) for char in query]
+        pattern = chars[0] + ''.join(f'[^{char}\\n]*{char}' for char in chars[1:])
+        # Первое совпадение такого шаблона — то же жадное вложение, что и в
+        # _subsequence_gaps, поэтому пропуски — это его длина минус длина запроса
+        name_list = self.name_list
+        ranked = [(400.0 - (width - len(query)) - len(name_list[name_id]) * 0.1, name_id)
+                  for name_id, width in self._grep_names(pattern)]
+        self._expand_names(ranked, prefix, limit, scores)
+
+    def _match_similar(self, query, prefix, scores):
+        """Ступень опечаток: пути с наибольшим числом общих с запросом триграмм (до 200)"""
+        counts = Counter()
+        for gram in trigrams(query):
+            file_ids = self.postings.get(gram)
+            if file_ids is not None:
+                counts.update(file_ids)
+        if not counts:
+            self._scan_subsequence(query, prefix, scores)
+            return
+        if prefix:
+            paths = self.paths
+            counts = Counter({file_id: count for file_id, count in counts.items()
+                              if paths[file_id] is not None and paths[file_id].startswith(prefix)})
+        ranked = (file_id for file_id, _ in counts.most_common(MAX_CANDIDATES))
+        for rel_path in self._live(ranked, prefix):
+            if rel_path not in scores:
+                score = fuzzy_score(query, rel_path)
+                if score > 0:
+                    scores[rel_path] = score
+
+    def _scan_subsequence(self, query, prefix, scores):
+        """Короткий запрос или ни одной общей триграммы: просматриваем пути
+        под prefix по порядку, пока не наберётся MAX_CANDIDATES путей,
+        где запрос — подпоследовательность"""
+        found = 0
+        for pos in range(bisect.bisect_left(self.order, prefix), len(self.order)):
+            rel_path = self.order[pos]
+            if not rel_path.startswith(prefix):
+                break
+            if rel_path not in scores:
+                if _subsequence_gaps(query, self._lower(rel_path)) is None:
+                    continue
+                scores[rel_path] = fuzzy_score(query, rel_path)
+            found += 1
+            if found >= MAX_CANDIDATES:
+                break
+
+    def find(self, query, limit=20, prefix=''):
+        """Лучшие limit путей для запроса: список (оценка, относительный путь).
+
+        prefix — искать только среди путей, начинающихся с него.
+        При равной оценке пути идут по алфавиту.
+        """
+        query = self._lower(query)
+        limit = max(limit, 1)
+        with self.lock:
+            scores = {}   # путь -> оценка
+            self._match_name_substring(query, prefix, limit, scores)
+            if _above(scores, 600) < limit:
+                self._match_path_substring(query, prefix, scores)
+            if _above(scores, 400) < limit:
+                self._match_name_subsequence(query, prefix, limit, scores)
+            if _above(scores, 200) < limit:
+                self._match_similar(query, prefix, scores)
+        return heapq.nsmallest(limit, ((score, path) for path, score in scores.items()),
+                               key=lambda item: (-item[0], item[1]))
@@ -0,0 +1,140 @@
+# file_hashing.py
+import os
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+
+try:
+    # Необязательная зависимость: xxhash в разы быстрее криптографических хэшей
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from file_ignore import EXCLUDES, IgnoreRules, check_cancelled, walk_files
+from file_stats import stats
+
+# Размер блока при потоковом хэшировании
+HASH_CHUNK = 1 << 20
+
+# Сколько байт из начала файла хэшировать на предварительном шаге
+PARTIAL_BYTES = 64 * 1024
+
+# Максимальное число дайджестов в кэше
+DIGEST_CACHE_ENTRIES = 500_000
+
+ALGORITHMS = {
+    "blake2b": lambda: hashlib.blake2b(digest_size=20),
+    "sha256": hashlib.sha256,
+}
+if xxhash is not None:
+    ALGORITHMS["xxh3"] = xxhash.xxh3_128
+
+
+def hash_file(filepath, algorithm="blake2b", limit=None):
+    """Дайджест файла, прочитанного блоками по HASH_CHUNK (или первых limit байт)"""
+    hasher = ALGORITHMS[algorithm]()
+    remaining = limit
+    total = 0
+    with open(filepath, 'rb') as f:
+        while remaining is None or remaining > 0:
+            check_cancelled()
+            chunk = f.read(HASH_CHUNK if remaining is None else min(HASH_CHUNK, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            total += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    stats.add_io(total)
+    return hasher.hexdigest()
+
+
+class DigestCache:
+    """Кэш дайджестов: действителен, пока у файла те же (size, mtime_ns)"""
+
+    def __init__(self, max_entries=DIGEST_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # (путь, алгоритм, limit) -> (size, mtime_ns, digest)
+        self.lock = threading.Lock()
+
+    def digest(self, filepath, algorithm="blake2b", limit=None):
+        st = os.stat(filepath)
+        key = (os.path.abspath(filepath), algorithm, limit)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+                self.entries.move_to_end(key)
+                return entry[2]
+        digest = hash_file(filepath, algorithm, limit)
+        with self.lock:
+            self.entries[key] = (st.st_size, st.st_mtime_ns, digest)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return digest
+
+
+def _group_by(paths, key_func, executor):
+    """Разбить пути на группы по key_func (вычисляется в пуле потоков)"""
+    groups = {}
+    # Каждому пути своя копия контекста: потоки пула видят флаг отмены вызова
+    keys = executor.map(lambda context, path: context.run(key_func, path),
+                        [contextvars.copy_context() for _ in paths], paths)
+    for path, key in zip(paths, keys):
+        if key is not None:
+            groups.setdefault(key, []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(directory, cache, executor, algorithm="blake2b", min_size=1,
+                    excludes=EXCLUDES):
+    """Группы файлов с одинаковым содержимым.
+
+    Сначала файлы группируются по размеру — файлы с уникальным размером
+    не читаются вовсе. Затем большие файлы разбиваются по хэшу первых
+    PARTIAL_BYTES и только оставшиеся кандидаты хэшируются целиком.
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"неизвестный алгоритм {algorithm}")
+
+    by_size = {}
+    with stats.phase("walk"):
+        for root, rel_dir, files in walk_files(directory, IgnoreRules(directory, excludes)):
+            check_cancelled()
+            for file in files:
+                filepath = os.path.join(root, file)
+                try:
+                    if os.path.islink(filepath):
+                        continue
+                    size = os.path.getsize(filepath)
+                except OSError:
+                    continue
+                if size >= min_size:
+                    by_size.setdefault(size, []).append(filepath)
+
+    def safe_digest(limit):
+        def digest(filepath):
+            try:
+                return cache.digest(filepath, algorithm, limit)
+            except OSError:
+                return None
+        return digest
+
+    duplicates = []
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        groups = [paths]
+        if size > PARTIAL_BYTES:
+            groups = _group_by(paths, safe_digest(PARTIAL_BYTES), executor)
+        for group in groups:
+            for same in _group_by(group, safe_digest(None), executor):
+                duplicates.append({
+                    "size": size,
+                    "digest": cache.digest(same[0], algorithm),
+                    "files": sorted(same),
+                    "wasted_bytes": size * (len(same) - 1)
+                })
+    duplicates.sort(key=lambda item: item["wasted_bytes"], reverse=True)
+    return duplicates
@@ -0,0 +1,188 @@
+# file_ignore.py
+import os
+import re
+import contextvars
+
+# Директории и файлы, которые пропускаются всегда (можно переопределить
+# через FILE_SERVER_EXCLUDE — список шаблонов через запятую)
+DEFAULT_EXCLUDES = (
+    '.git', '.hg', '.svn', 'node_modules', 'venv', '.venv', '__pycache__',
+    '.tox', '.nox', '.mypy_cache', '.pytest_cache', '.ruff_cache', 'build', 'dist',
+)
+EXCLUDES = tuple(
+    item.strip() for item in os.environ.get("FILE_SERVER_EXCLUDE", "").split(',') if item.strip()
+) or DEFAULT_EXCLUDES
+
+# Файлы с правилами игнорирования в синтаксисе .gitignore
+IGNORE_FILES = ('.gitignore', '.ignore')
+
+# Сколько байт читать из начала файла, чтобы распознать двоичный
+SNIFF_BYTES = 8192
+
+# Флаг отмены вызова, в контексте которого идёт работа (threading.Event,
+# задаёт сервер в run_blocking). Контекст копируется в потоки пула
+# вместе с форматом ответов, поэтому флаг видят и они
+_cancel_event = contextvars.ContextVar("cancel_event", default=None)
+
+
+class Cancelled(Exception):
+    """Клиент отменил вызов, пока шла долгая операция"""
+
+
+def set_cancel_event(event):
+    """Флаг отмены для работы в текущем контексте"""
+    _cancel_event.set(event)
+
+
+def cancelled():
+    """Отменил ли клиент вызов, выполняемый в текущем контексте"""
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def check_cancelled():
+    """Прервать обход или индексацию исключением Cancelled, если вызов отменён"""
+    if cancelled():
+        raise Cancelled("вызов отменён")
+
+
+def is_binary(filepath):
+    """Похож ли файл на двоичный: есть ли NUL-байт в начале"""
+    try:
+        with open(filepath, 'rb') as f:
+            return b'\0' in f.read(SNIFF_BYTES)
+    except OSError:
+        return True
+
+
+def _glob_to_regex(pattern):
+    """Шаблон .gitignore -> регулярное выражение для пути с разделителем '/'"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            out.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(''.join(out) + r'\Z')
+
+
+class IgnoreRules:
+    """Правила игнорирования для одного дерева.
+
+    Общий список EXCLUDES плюс файлы .gitignore/.ignore, которые
+    подгружаются по мере обхода: правила из вложенной директории
+    действуют только внутри неё. Поддерживаются комментарии, отрицание
+    (!), привязка к директории (/ в начале или в середине), шаблоны
+    только для директорий (/ в конце) и **.
+    """
+
+    def __init__(self, root, excludes=EXCLUDES):
+        self.root = root
+        # (база, regex, отрицание, только директории, сопоставлять с полным путём)
+        self.rules = [('', _glob_to_regex(p), False, False, False) for p in excludes]
+        self.loaded = set()
+
+    def load_dir(self, rel_dir):
+        """Прочитать .gitignore/.ignore из директории (rel_dir с '/', '' — корень)"""
+        if rel_dir in self.loaded:
+            return
+        self.loaded.add(rel_dir)
+        for name in IGNORE_FILES:
+            try:
+                with open(os.path.join(self.root, rel_dir, name), 'r', encoding='utf-8') as f:
+                    lines = f.read().splitlines()
+            except (OSError, UnicodeDecodeError):
+                continue
+            for line in lines:
+                self._add_rule(rel_dir, line)
+
+    def _add_rule(self, base, line):
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            return
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        anchored = '/' in line
+        line = line.lstrip('/')
+        if line:
+            self.rules.append((base, _glob_to_regex(line), negate, dir_only, anchored))
+
+    def ignored(self, rel_path, is_dir):
+        """Игнорируется ли путь (относительно корня, разделитель '/')"""
+        result = False
+        name = rel_path.rsplit('/', 1)[-1]
+        for base, regex, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + '/'):
+                    continue
+                local = rel_path[len(base) + 1:]
+            else:
+                local = rel_path
+            if regex.match(local if anchored else name):
+                result = not negate
+        return result
+
+    def excluded(self, rel_path, is_dir=False):
+        """Игнорируется ли путь сам или через одну из директорий над ним.
+
+        В отличие от ignored() проверяет всю цепочку директорий (как обход,
+        который в игнорируемые директории не заходит) и подгружает их
+        .gitignore. Нужен для путей, пришедших не из обхода.
+        """
+        parts = rel_path.split('/')
+        for depth in range(len(parts)):
+            self.load_dir('/'.join(parts[:depth]))
+            last = depth == len(parts) - 1
+            if self.ignored('/'.join(parts[:depth + 1]), is_dir or not last):
+                return True
+        return False
+
+
+def walk_files(root, rules=None, subdir=''):
+    """os.walk с отсечением игнорируемых директорий прямо в dirs[:].
+
+    Отдаёт (dirpath, относительный путь директории с '/', файлы),
+    игнорируемые файлы и директории в выдачу не попадают. subdir —
+    обойти только эту поддиректорию root (путь с '/'); пути и правила
+    по-прежнему считаются от root.
+    """
+    if rules is None:
+        rules = IgnoreRules(root)
+    start = root
+    if subdir:
+        if rules.excluded(subdir, True):
+            return
+        start = os.path.join(root, subdir.replace('/', os.sep))
+    # os.walk строит пути вложенных директорий как os.path.join(root, ...),
+    # поэтому относительный путь — просто срез без os.path.relpath
+    skip = len(os.path.join(root, ''))
+    for dirpath, dirs, files in os.walk(start):
+        rel_dir = dirpath[skip:].replace(os.sep, '/') if dirpath != root else ''
+        prefix = rel_dir + '/' if rel_dir else ''
+        rules.load_dir(rel_dir)
+        dirs[:] = [d for d in dirs if not rules.ignored(prefix + d, True)]
+        yield dirpath, rel_dir, [f for f in files if not rules.ignored(prefix + f, False)]
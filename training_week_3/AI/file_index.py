@@ -0,0 +1,488 @@
+# file_index.py
+import os
+import time
+import pickle
+import hashlib
+import threading
+from array import array
+from collections import deque
+from pathlib import Path
+
+from file_ignore import (EXCLUDES, IGNORE_FILES, Cancelled, IgnoreRules, cancelled,
+                         check_cancelled, is_binary, walk_files)
+from file_stats import stats
+
+try:
+    # Необязательная зависимость: события inotify (только Linux)
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+# Расширения файлов, по которым выполняется поиск
+SEARCH_EXTENSIONS = ('.txt', '.py', '.md', '.json')
+
+# Каталог, где хранятся индексы (по одному файлу на каждую директорию поиска)
+INDEX_DIR = Path(os.environ.get(
+    "FILE_SERVER_INDEX_DIR",
+    Path.home() / ".cache" / "simple_file_server"
+))
+
+INDEX_VERSION = 4
+
+# Сколько файлов индексов хранить в INDEX_DIR и через сколько секунд
+# без использования индекс удаляется (по умолчанию — 30 дней)
+INDEX_MAX_FILES = int(os.environ.get("FILE_SERVER_INDEX_MAX_FILES", 32))
+INDEX_MAX_AGE = float(os.environ.get("FILE_SERVER_INDEX_MAX_AGE", 30 * 24 * 3600))
+
+# Массивы уплотняются, когда удалённых id больше, чем живых (и не меньше порога)
+COMPACT_MIN_DEAD = 1024
+
+# Размер окна (в символах) при чтении файла для индексации
+READ_CHUNK_CHARS = 1 << 20
+
+
+def trigrams(text):
+    """Множество триграмм строки"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def iter_dir_entries(directory, depth=0, prefix=''):
+    """Записи директории через os.scandir: пары (относительное имя, DirEntry).
+
+    depth — сколько уровней вложенных директорий обходить (-1 — без ограничения).
+    Записи отдаются по мере чтения, открытыми остаются только директории
+    текущей ветки. Ошибка чтения самой directory пробрасывается, а
+    нечитаемые вложенные директории (нет прав, удалены во время обхода)
+    пропускаются.
+    """
+    with os.scandir(directory) as it:
+        for entry in it:
+            check_cancelled()
+            yield prefix + entry.name, entry
+            if depth != 0 and entry.is_dir(follow_symlinks=False):
+                try:
+                    yield from iter_dir_entries(entry.path, depth - 1, prefix + entry.name + os.sep)
+                except OSError:
+                    continue
+
+
+def stat_key(st):
+    """Ключ изменения файла: (size, mtime_ns, inode)"""
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class InotifyWatcher:
+    """Наблюдение за деревом директорий через inotify.
+
+    Копит относительные пути изменённых файлов между вызовами drain().
+    Если очередь ядра переполнилась, выставляет флаг overflowed —
+    тогда вызывающий код должен сделать полный обход.
+    """
+
+    def __init__(self, root, rules):
+        self.root = root
+        self.rules = rules
+        self.inotify = INotify()
+        self.mask = (
+            inotify_flags.CREATE | inotify_flags.DELETE | inotify_flags.MODIFY
+            | inotify_flags.CLOSE_WRITE | inotify_flags.ATTRIB
+            | inotify_flags.MOVED_FROM | inotify_flags.MOVED_TO
+            | inotify_flags.DELETE_SELF
+        )
+        self.watches = {}   # wd -> относительный путь директории
+        self.overflowed = False
+        self._watch_tree('.', set())
+
+    def _watch_tree(self, rel_dir, dirty):
+        """Подписаться на директорию и все вложенные, собрав их файлы в dirty"""
+        subdir = '' if rel_dir == '.' else rel_dir.replace(os.sep, '/')
+        # Игнорируемые директории (по правилам всего дерева, с .gitignore
+        # и excludes корня) отсекаются при обходе, на них не подписываемся.
+        # Отмена вызова обход не прерывает: события, из-за которых он
+        # идёт, уже прочитаны, и недообойдённое поддерево потерялось бы
+        for root, sub_rel, files in walk_files(self.root, self.rules, subdir):
+            try:
+                wd = self.inotify.add_watch(root, self.mask)
+            except OSError:
+                # Например, закончился лимит max_user_watches
+                self.overflowed = True
+                continue
+            rel_root = sub_rel.replace('/', os.sep) if sub_rel else '.'
+            self.watches[wd] = rel_root
+            for file in files:
+                dirty.add(os.path.normpath(os.path.join(rel_root, file)))
+
+    def drain(self):
+        """Забрать накопленные изменения, не блокируясь"""
+        dirty = set()
+        for event in self.inotify.read(timeout=0):
+            if event.mask & inotify_flags.Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            rel_dir = self.watches.get(event.wd)
+            if rel_dir is None:
+                continue
+            if event.mask & inotify_flags.IGNORED:
+                del self.watches[event.wd]
+                continue
+            if not event.name:
+                continue
+            rel_path = os.path.normpath(os.path.join(rel_dir, event.name))
+            if event.mask & inotify_flags.ISDIR:
+                if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                    self._watch_tree(rel_path, dirty)
+                elif event.mask & (inotify_flags.DELETE | inotify_flags.MOVED_FROM):
+                    # Файлы удалённой директории найдёт полный обход
+                    self.overflowed = True
+                continue
+            dirty.add(rel_path)
+        return dirty
+
+    def close(self):
+        self.inotify.close()
+
+
+class FileTracker:
+    """Отслеживание изменений файлов дерева по (size, mtime_ns, inode).
+
+    С inotify после первого обхода проверяются лишь пути, о которых
+    сообщило ядро, так что стоимость зависит от числа изменений, а не от
+    размера дерева. Без inotify каждый вызов changes() — полный stat-обход
+    (без чтения файлов): иначе поиск не увидел бы файлы, изменённые
+    в обход сервера. extensions=None — отслеживать все файлы,
+    excludes — общие шаблоны игнорирования для этого дерева.
+    """
+
+    def __init__(self, root, stats=None, use_inotify=True, extensions=SEARCH_EXTENSIONS,
+                 excludes=EXCLUDES):
+        self.root = root
+        self.stats = stats if stats is not None else {}   # путь -> stat_key
+        self.extensions = extensions
+        self.excludes = excludes
+        self.rules = IgnoreRules(root, excludes)
+        self.watcher = None
+        if use_inotify and INotify is not None:
+            try:
+                self.watcher = InotifyWatcher(root, self.rules)
+            except OSError:
+                self.watcher = None
+        # Пути из notify(): очередь пополняется из любых потоков без
+        # блокировок, а разбирает её changes()
+        self.pending = deque()
+        self.need_scan = True
+
+    def _tracked(self, name):
+        return self.extensions is None or name.endswith(self.extensions)
+
+    def _full_scan(self):
+        # Правила перечитываются при каждом полном обходе
+        self.rules = IgnoreRules(self.root, self.excludes)
+        if self.watcher is not None:
+            self.watcher.rules = self.rules
+        current = {}
+        for root, rel_dir, files in walk_files(self.root, self.rules):
+            check_cancelled()
+            # Относительные пути собираются конкатенацией: os.path.relpath
+            # на каждый файл заметно дороже самого stat
+            prefix = rel_dir.replace('/', os.sep) + os.sep if rel_dir else ''
+            for file in files:
+                if not self._tracked(file):
+                    continue
+                try:
+                    current[prefix + file] = stat_key(os.stat(os.path.join(root, file)))
+                except OSError:
+                    continue
+        return current
+
+    def notify(self, path):
+        """Сообщить об изменении файла path (абсолютного или относительного cwd).
+
+        Не ждёт обновления индекса: путь проверится при следующем changes().
+        """
+        full = os.path.abspath(path)
+        if full.startswith(self.root + os.sep):
+            self.pending.append(full[len(self.root) + 1:])
+
+    def forget(self, rel_paths):
+        """Забыть stat путей, которые вызывающий не успел обработать,
+        чтобы следующий changes() вернул их снова"""
+        for rel_path in rel_paths:
+            self.stats.pop(rel_path, None)
+            self.pending.append(rel_path)
+
+    def _drain_pending(self):
+        dirty = set()
+        while True:
+            try:
+                dirty.add(self.pending.popleft())
+            except IndexError:
+                return dirty
+
+    def _scan_due(self):
+        return self.need_scan or self.watcher is None or self.watcher.overflowed
+
+    def changes(self):
+        """Вернуть (изменённые, удалённые) пути с момента прошлого вызова"""
+        if self._scan_due():
+            # Прерванный отменой обход повторится при следующем вызове
+            self.need_scan = True
+            if self.watcher is not None:
+                # События до полного обхода уже ничего не добавят
+                self.watcher.drain()
+                self.watcher.overflowed = False
+            self._drain_pending()
+            current = self._full_scan()
+            changed = [p for p, key in current.items() if self.stats.get(p) != key]
+            removed = list(self.stats.keys() - current.keys())
+            self.stats = current
+            self.need_scan = False
+            return changed, removed
+
+        dirty = self._drain_pending() | self.watcher.drain()
+        if any(os.path.basename(p) in IGNORE_FILES for p in dirty):
+            # Изменились правила игнорирования — нужен полный обход
+            self.need_scan = True
+            return self.changes()
+        changed, removed = [], []
+        for rel_path in dirty:
+            if not self._tracked(rel_path):
+                continue
+            # Путь мог прийти из notify() или из только что созданной
+            # директории — проверяем и директории над ним
+            if self.rules.excluded(rel_path.replace(os.sep, '/')):
+                continue
+            try:
+                key = stat_key(os.stat(os.path.join(self.root, rel_path)))
+            except OSError:
+                if self.stats.pop(rel_path, None) is not None:
+                    removed.append(rel_path)
+                continue
+            if self.stats.get(rel_path) != key:
+                self.stats[rel_path] = key
+                changed.append(rel_path)
+        return changed, removed
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+
+class TrigramIndex:
+    """Триграммный индекс текстовых файлов одной директории.
+
+    Файлам выдаются целочисленные id, а для каждой триграммы содержимого
+    (в нижнем регистре) хранится компактный массив id файлов, где она
+    встречается. Множества триграмм отдельных файлов не хранятся: при
+    изменении файла его старый id помечается удалённым и отсеивается при
+    выборке, а массивы периодически уплотняются. Поиск подстроки сводится
+    к пересечению массивов для триграмм искомой строки; найденных
+    кандидатов затем проверяет вызывающий код. Какие файлы перечитать,
+    решает FileTracker.
+    """
+
+    def __init__(self, root, use_inotify=True, excludes=EXCLUDES):
+        self.root = os.path.abspath(root)
+        self.paths = []        # id -> относительный путь (None — удалённый id)
+        self.ids = {}          # относительный путь -> id
+        self.binary = set()    # двоичные и нечитаемые файлы (без триграмм)
+        self.postings = {}     # триграмма -> array('I') id файлов
+        self.dead = 0          # сколько id в paths помечены удалёнными
+        self.tracker = FileTracker(self.root, use_inotify=use_inotify, excludes=excludes)
+        self.dirty = False
+        # Обновление, сохранение и выборка кандидатов — под блокировкой
+        # самого индекса, так что индексы разных директорий не ждут друг друга
+        self.lock = threading.RLock()
+
+    @property
+    def index_path(self):
+        digest = hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]
+        return INDEX_DIR / f"{digest}.pickle"
+
+    @classmethod
+    def load(cls, root, use_inotify=True, excludes=EXCLUDES):
+        """Загрузить индекс с диска или создать пустой"""
+        index = cls(root, use_inotify=use_inotify, excludes=excludes)
+        try:
+            with open(index.index_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("root") == index.root:
+                index._unpack(data)
+                # mtime файла индекса — время последнего использования (см. prune_index_dir)
+                os.utime(index.index_path)
+        except (OSError, pickle.PickleError, EOFError, KeyError, ValueError):
+            pass
+        return index
+
+    def _unpack(self, data):
+        # На диске все массивы склеены в один: триграммы (ровно по 3 символа)
+        # идут одной строкой, counts — длины массивов по порядку
+        grams, counts, ids = data["grams"], data["counts"], data["ids"]
+        postings = {}
+        pos = 0
+        for number, count in enumerate(counts):
+            postings[grams[number * 3:number * 3 + 3]] = ids[pos:pos + count]
+            pos += count
+        self.paths = data["paths"]
+        self.ids = {path: file_id for file_id, path in enumerate(self.paths) if path is not None}
+        self.binary = set(data["binary"])
+        self.dead = len(self.paths) - len(self.ids)
+        self.postings = postings
+        self.tracker.stats = data["stats"]
+
+    def save(self):
+        """Атомарно сохранить индекс на диск"""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_suffix('.tmp')
+            ids = array('I')
+            for file_ids in self.postings.values():
+                ids.extend(file_ids)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({
+                    "version": INDEX_VERSION,
+                    "root": self.root,
+                    "grams": ''.join(self.postings),
+                    "counts": array('I', map(len, self.postings.values())),
+                    "ids": ids,
+                    "paths": self.paths,
+                    "binary": sorted(self.binary),
+                    "stats": self.tracker.stats,
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.index_path)
+            self.dirty = False
+            prune_index_dir(keep=self.index_path)
+
+    def remove(self, rel_path):
+        """Удалить файл из индекса: его id помечается удалённым"""
+        file_id = self.ids.pop(rel_path, None)
+        if file_id is None:
+            return
+        self.paths[file_id] = None
+        self.binary.discard(rel_path)
+        self.dead += 1
+        self.dirty = True
+        if self.dead > max(len(self.ids), COMPACT_MIN_DEAD):
+            self.compact()
+
+    def compact(self):
+        """Убрать удалённые id из массивов и перенумеровать файлы подряд"""
+        remap = array('I', bytes(4 * len(self.paths)))
+        paths = []
+        for file_id, path in enumerate(self.paths):
+            if path is not None:
+                remap[file_id] = len(paths)
+                paths.append(path)
+        for gram, file_ids in list(self.postings.items()):
+            live = array('I', [remap[file_id] for file_id in file_ids if self.paths[file_id] is not None])
+            if live:
+                self.postings[gram] = live
+            else:
+                del self.postings[gram]
+        self.paths = paths
+        self.ids = {path: file_id for file_id, path in enumerate(paths)}
+        self.dead = 0
+        self.dirty = True
+
+    def add(self, rel_path):
+        """Прочитать файл и добавить его триграммы в индекс"""
+        self.remove(rel_path)
+        filepath = os.path.join(self.root, rel_path)
+        # Двоичные и нечитаемые файлы запоминаем без триграмм,
+        # чтобы не перечитывать их до следующего изменения
+        grams = None
+        if not is_binary(filepath):
+            try:
+                grams = set()
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    # Читаем окнами, перенося два символа, чтобы не терять
+                    # триграммы на стыке и не держать весь файл в памяти
+                    tail = ''
+                    while True:
+                        chunk = f.read(READ_CHUNK_CHARS)
+                        if not chunk:
+                            break
+                        text = tail + chunk.lower()
+                        grams |= trigrams(text)
+                        tail = text[-2:]
+                stats.add_io(os.path.getsize(filepath))
+            except (OSError, UnicodeDecodeError):
+                grams = None
+        # Новый id всегда больше прежних, поэтому массивы остаются отсортированными
+        file_id = len(self.paths)
+        self.paths.append(rel_path)
+        self.ids[rel_path] = file_id
+        if grams is None:
+            self.binary.add(rel_path)
+        for gram in grams or ():
+            file_ids = self.postings.get(gram)
+            if file_ids is None:
+                self.postings[gram] = array('I', (file_id,))
+            else:
+                file_ids.append(file_id)
+        self.dirty = True
+
+    def refresh(self):
+        """Перечитать только те файлы, у которых изменился stat"""
+        with self.lock:
+            changed, removed = self.tracker.changes()
+            for rel_path in removed:
+                self.remove(rel_path)
+            for done, rel_path in enumerate(changed):
+                if cancelled():
+                    # Непрочитанные файлы трекер вернёт при следующем refresh()
+                    self.tracker.forget(changed[done:])
+                    raise Cancelled("вызов отменён")
+                self.add(rel_path)
+            return len(changed) + len(removed)
+
+    def candidates(self, search_term):
+        """Файлы, которые могут содержать search_term (без учёта регистра)"""
+        with self.lock:
+            grams = trigrams(search_term.lower())
+            if not grams:
+                # Слишком короткая строка: проверяем все текстовые файлы
+                return sorted(rel_path for rel_path in self.ids if rel_path not in self.binary)
+            postings = [self.postings.get(gram) for gram in grams]
+            if any(file_ids is None for file_ids in postings):
+                return []
+            postings.sort(key=len)
+            result = set(postings[0])
+            for file_ids in postings[1:]:
+                result.intersection_update(file_ids)
+                if not result:
+                    break
+            paths = self.paths
+            return sorted(paths[file_id] for file_id in result if paths[file_id] is not None)
+
+
+def prune_index_dir(keep=None, max_files=None, max_age=None):
+    """Удалить из INDEX_DIR давно не использованные индексы.
+
+    Остаются не больше max_files самых свежих файлов индексов, и только
+    те, что использовались в последние max_age секунд. keep не удаляется.
+    Временные файлы прерванных сохранений удаляются через час.
+    """
+    max_files = INDEX_MAX_FILES if max_files is None else max_files
+    max_age = INDEX_MAX_AGE if max_age is None else max_age
+    now = time.time()
+    try:
+        entries = []
+        for entry in os.scandir(INDEX_DIR):
+            if entry.name.endswith('.pickle'):
+                entries.append((entry.stat().st_mtime, entry.path))
+            elif entry.name.endswith('.tmp') and now - entry.stat().st_mtime > 3600:
+                os.remove(entry.path)
+    except OSError:
+        return
+    entries.sort(reverse=True)
+    for number, (mtime, path) in enumerate(entries):
+        if keep is not None and path == str(keep):
+            continue
+        if number >= max_files or now - mtime > max_age:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
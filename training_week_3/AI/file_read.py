@@ -0,0 +1,46 @@
+# file_read.py
+import codecs
+from itertools import islice
+
+from file_stats import stats
+
+# Размер страницы по умолчанию для постраничного чтения
+PAGE_SIZE = 64 * 1024
+
+
+def _is_continuation(byte):
+    """Байт-продолжение многобайтового символа UTF-8 (10xxxxxx)"""
+    return byte & 0xC0 == 0x80
+
+
+def read_range(filepath, offset=0, length=PAGE_SIZE):
+    """Прочитать не больше length байт файла, начиная с offset.
+
+    Границы подравниваются под символы UTF-8: обрезанный в начале символ
+    пропускается, обрезанный в конце остаётся для следующей страницы.
+    Возвращает (текст, смещение следующей страницы, достигнут ли конец).
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+        eof = len(data) < length or not f.peek(1)
+    stats.add_io(len(data))
+
+    start = 0
+    while start < len(data) and start < 3 and _is_continuation(data[start]):
+        start += 1
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    text = decoder.decode(data[start:], final=eof)
+    pending = len(decoder.getstate()[0])
+    if pending and pending == len(data) - start:
+        # Страница меньше одного символа: дочитываем его целиком
+        return read_range(filepath, offset, length + 4)
+    return text, offset + len(data) - pending, eof and not pending
+
+
+def read_lines(filepath, start_line=1, end_line=None):
+    """Прочитать строки с start_line по end_line включительно (нумерация с 1)"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        text = ''.join(islice(f, max(start_line, 1) - 1, end_line))
+        stats.add_io(f.buffer.tell())
+    return text
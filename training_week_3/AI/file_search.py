@@ -0,0 +1,437 @@
+# file_search.py
+import io
+import os
+import re
+import mmap
+import codecs
+import time
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from file_ignore import EXCLUDES, IgnoreRules, check_cancelled, is_binary, walk_files
+from file_index import SEARCH_EXTENSIONS
+from file_stats import stats
+
+# Количество файлов в одном задании для пула процессов
+SHARD_SIZE = 256
+
+# Файлы не меньше порога читаются через mmap окнами фиксированного размера,
+# поэтому пиковая память не зависит от размера файла
+MMAP_THRESHOLD = 1 << 20
+WINDOW_SIZE = 1 << 22
+
+# Режимы поиска: подстрока, регулярное выражение, целое слово,
+# все слова запроса (И) или любое из них (ИЛИ)
+SEARCH_MODES = ("literal", "regex", "word", "all", "any")
+
+# Сколько совпадений на файл возвращать по умолчанию в режимах со строками
+DEFAULT_MAX_MATCHES = 100
+
+# Сколько символов контекста брать слева и справа от совпадения
+SNIPPET_CONTEXT = 40
+
+# Сколько ждать добора страницы после появления первого результата (секунды)
+PAGE_LINGER = 0.05
+
+# Сколько результатов постраничный поиск копит впрок: дальше он ждёт,
+# пока потребитель заберёт страницу
+STREAM_BUFFER = 1000
+
+
+# Общий пул процессов поиска, создаётся при первом поиске без индекса
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def default_workers():
+    """Число процессов для поиска: FILE_SERVER_WORKERS или число CPU"""
+    return int(os.environ.get("FILE_SERVER_WORKERS", 0)) or os.cpu_count() or 1
+
+
+def get_pool():
+    """Долгоживущий пул из default_workers() процессов.
+
+    Процессы запускаются через forkserver (на Windows — spawn), а не fork:
+    сервер многопоточный, и fork его процесса может оставить в дочернем
+    захваченные другими потоками блокировки.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                # Воркеры форкаются от forkserver с уже импортированным модулем поиска
+                context.set_forkserver_preload(["__main__", __name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=default_workers(), mp_context=context)
+        return _pool
+
+
+def _reset_pool(pool):
+    """Забыть сломанный пул (умер процесс-воркер), следующий поиск создаст новый"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def count_matches(filepath, needle, cache=None):
+    """Число вхождений needle (уже в нижнем регистре) в файл; None, если файл не прочитать.
+
+    Небольшие файлы читаются через cache (ReadCache), если он передан.
+    """
+    try:
+        size = os.path.getsize(filepath)
+        if needle and size >= MMAP_THRESHOLD:
+            stats.add_io(size)
+            with stats.phase("match"):
+                return _count_mapped(filepath, needle)
+        if cache is not None:
+            text = cache.read_text(filepath)
+        else:
+            with stats.phase("read"):
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            stats.add_io(size)
+        with stats.phase("match"):
+            return text.lower().count(needle)
+    except (OSError, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _count_mapped(filepath, needle):
+    """Подсчёт совпадений по окнам отображённого в память файла"""
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        starts = range(0, size, WINDOW_SIZE)
+        if needle.isascii():
+            # bytes.lower() меняет только ASCII-буквы, а байты многобайтовых
+            # символов UTF-8 не пересекаются с ASCII — декодировать не нужно
+            chunks = (mm[i:i + WINDOW_SIZE].lower() for i in starts)
+            return _count_in_chunks(chunks, needle.encode('ascii'))
+
+        # Кириллица и прочее: инкрементальный декодер корректно склеивает
+        # символы, разрезанные границей окна
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        chunks = (
+            decoder.decode(mm[i:i + WINDOW_SIZE], final=i + WINDOW_SIZE >= size).lower()
+            for i in starts
+        )
+        return _count_in_chunks(chunks, needle)
+
+
+def _has_border(needle):
+    """Совпадает ли начало needle с его концом (тогда вхождения могут перекрываться)"""
+    return any(needle[:k] == needle[-k:] for k in range(1, len(needle)))
+
+
+def _count_in_chunks(chunks, needle):
+    """Неперекрывающиеся вхождения needle в поток фрагментов — как у str.count.
+
+    Между фрагментами переносится хвост длиной до len(needle) - 1,
+    но не раньше конца последнего найденного вхождения, чтобы
+    совпадения на стыке не считались дважды.
+    """
+    total = 0
+    keep = len(needle) - 1
+    bordered = _has_border(needle)
+    carry = needle[:0]
+    for chunk in chunks:
+        buf = carry + chunk
+        last_end = 0
+        if bordered:
+            pos = buf.find(needle)
+            while pos >= 0:
+                total += 1
+                last_end = pos + len(needle)
+                pos = buf.find(needle, last_end)
+        else:
+            total += buf.count(needle)
+            pos = buf.rfind(needle)
+            if pos >= 0:
+                last_end = pos + len(needle)
+        carry = buf[max(last_end, len(buf) - keep):]
+    return total
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(search_term, mode):
+    """Скомпилировать запрос один раз: (общий шаблон, шаблоны обязательных слов).
+
+    Кэш живёт между вызовами, поэтому повторные запросы не компилируются заново.
+    """
+    flags = re.IGNORECASE
+    if mode == "regex":
+        return re.compile(search_term, flags), ()
+    if mode == "word":
+        return re.compile(rf"\b{re.escape(search_term)}\b", flags), ()
+    if mode in ("all", "any"):
+        terms = search_term.split()
+        if not terms:
+            raise ValueError("пустой запрос")
+        pattern = re.compile("|".join(re.escape(term) for term in terms), flags)
+        if mode == "any":
+            return pattern, ()
+        return pattern, tuple(re.compile(re.escape(term), flags) for term in terms)
+    raise ValueError(f"неизвестный режим поиска {mode}")
+
+
+def _snippet(line, match):
+    """Фрагмент строки вокруг совпадения не длиннее 2 * SNIPPET_CONTEXT + совпадение"""
+    start = max(match.start() - SNIPPET_CONTEXT, 0)
+    end = min(match.end() + SNIPPET_CONTEXT, len(line))
+    return line[start:end].strip()
+
+
+def find_matches(lines, query, max_matches):
+    """Совпадения с номерами строк; сканирование строк прекращается на max_matches.
+
+    В режиме "all" файл подходит, только если в нём есть каждое слово,
+    поэтому после набора max_matches ищутся лишь недостающие слова.
+    """
+    pattern, required = query
+    missing = list(required)
+    hits = []
+    for lineno, line in enumerate(lines, 1):
+        if missing:
+            missing = [term for term in missing if term.search(line) is None]
+        if len(hits) < max_matches:
+            for match in pattern.finditer(line):
+                hits.append({"line": lineno, "text": _snippet(line, match)})
+                if len(hits) >= max_matches:
+                    break
+        elif not missing:
+            break
+    return [] if missing else hits
+
+
+def iter_lines(filepath, cache=None):
+    """Строки файла: небольшие берутся из кэша, крупные читаются потоком.
+
+    В обоих случаях строки делятся только по переводам строк, как при
+    чтении файла (и в read_lines): str.splitlines() делил бы ещё по form
+    feed, NEL, U+2028 и другим разделителям, и номера строк расходились
+    бы с read_file.
+    """
+    if cache is not None and os.path.getsize(filepath) < MMAP_THRESHOLD:
+        # Текст из кэша прочитан с универсальными переводами строк — в нём только \n
+        for line in io.StringIO(cache.read_text(filepath)):
+            yield line.rstrip('\n')
+        return
+    stats.add_io(os.path.getsize(filepath))
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def search_file(filepath, search_term, mode="literal", max_matches=0, cache=None):
+    """Результат поиска в одном файле ({"file", "matches", ...}) или None"""
+    if mode == "literal":
+        matches = count_matches(filepath, search_term.lower(), cache)
+        return {"file": filepath, "matches": matches} if matches else None
+
+    query = compile_query(search_term, mode)
+    try:
+        with stats.phase("match"):
+            hits = find_matches(iter_lines(filepath, cache), query, max_matches or DEFAULT_MAX_MATCHES)
+    except (OSError, UnicodeDecodeError):
+        return None
+    if not hits:
+        return None
+    return {"file": filepath, "matches": len(hits), "lines": hits}
+
+
+def query_candidates(index, search_term, mode="literal"):
+    """Файлы-кандидаты из TrigramIndex для запроса в режиме mode"""
+    if mode in ("all", "any"):
+        sets = [set(index.candidates(term)) for term in search_term.split()]
+        if not sets:
+            return []
+        merged = set.intersection(*sets) if mode == "all" else set.union(*sets)
+        return sorted(merged)
+    if mode == "regex":
+        # Из регулярного выражения триграммы не извлекаем — проверяем все файлы
+        return index.candidates("")
+    return index.candidates(search_term)
+
+
+def search_shard(filepaths, search_term, mode="literal", max_matches=0):
+    """Поиск в одной группе файлов (выполняется в дочернем процессе)"""
+    results = []
+    for filepath in filepaths:
+        if is_binary(filepath):
+            continue
+        result = search_file(filepath, search_term, mode, max_matches)
+        if result:
+            results.append(result)
+    return results
+
+
+def iter_shards(directory, shard_size=SHARD_SIZE, excludes=EXCLUDES):
+    """Разбить файлы обхода (с учётом правил игнорирования) на группы по shard_size"""
+    shard = []
+    for root, rel_dir, files in walk_files(directory, IgnoreRules(directory, excludes)):
+        check_cancelled()
+        for file in files:
+            if file.endswith(SEARCH_EXTENSIONS):
+                shard.append(os.path.join(root, file))
+                if len(shard) >= shard_size:
+                    yield shard
+                    shard = []
+    if shard:
+        yield shard
+
+
+def iter_parallel_search(directory, search_term, workers=None, shard_size=SHARD_SIZE,
+                         mode="literal", max_matches=0, excludes=EXCLUDES):
+    """Поиск без индекса на общем пуле процессов (см. get_pool()).
+
+    Обход директории идёт в текущем процессе, а чтение и подсчёт
+    совпадений — в воркерах. workers — сколько групп файлов этот поиск
+    обрабатывает одновременно (не больше размера пула). Результаты
+    по файлам отдаются в порядке завершения групп, а не в порядке обхода.
+    """
+    if mode != "literal":
+        # Ошибка в запросе должна всплыть сразу, а не в каждом воркере
+        compile_query(search_term, mode)
+    workers = min(workers or default_workers(), default_workers())
+    if workers == 1:
+        for shard in iter_shards(directory, shard_size, excludes):
+            yield from search_shard(shard, search_term, mode, max_matches)
+        return
+
+    pool = get_pool()
+    futures = set()
+    try:
+        for shard in iter_shards(directory, shard_size, excludes):
+            futures.add(pool.submit(search_shard, shard, search_term, mode, max_matches))
+            # Пул общий: в работе не больше workers групп этого поиска
+            if len(futures) >= workers:
+                done = next(as_completed(futures))
+                futures.remove(done)
+                yield from done.result()
+        for future in as_completed(futures):
+            futures.remove(future)
+            yield from future.result()
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise
+    finally:
+        # Если вызывающий код прервал обход, ещё не начатые группы отменяются;
+        # уже начатые доработают в пуле, их результаты не нужны
+        for future in futures:
+            future.cancel()
+
+
+class ResultStream:
+    """Результаты поиска, которые вычисляются в фоновом потоке.
+
+    Потребитель забирает их страницами через take() по мере появления,
+    не дожидаясь конца обхода. Когда в буфере max_buffer результатов,
+    поток вызывает on_pause() и ждёт следующего take(), а перед
+    продолжением — on_resume(); если take() нет дольше idle_timeout
+    секунд, поиск считается брошенным. Поток останавливается на
+    max_results результатах, по cancel() или по брошенности, после чего
+    вызывает on_done() — если не остановился на паузе после on_pause().
+    """
+
+    def __init__(self, results, max_results=0, on_done=None, max_buffer=STREAM_BUFFER,
+                 idle_timeout=None, on_pause=None, on_resume=None):
+        self.buffer = []
+        self.count = 0
+        self.done = False
+        self.error = None
+        self.max_results = max_results
+        self.on_done = on_done
+        self.max_buffer = max_buffer
+        self.idle_timeout = idle_timeout
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.released = False   # на паузе вызван on_pause(), но ещё не on_resume()
+        self.last_access = time.monotonic()
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, args=(results,), daemon=True)
+        self._thread.start()
+
+    def _run(self, results):
+        try:
+            for result in results:
+                if self._cancel.is_set() or not self._wait_for_room():
+                    break
+                with self._cond:
+                    self.buffer.append(result)
+                    self.count += 1
+                    self._cond.notify_all()
+                if self.max_results and self.count >= self.max_results:
+                    break
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            # Закрываем генератор здесь, чтобы обход и пул процессов завершились
+            results.close()
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            if self.on_done is not None and not self.released:
+                self.on_done()
+
+    def _wait_for_room(self):
+        """Дождаться места в буфере; False — поиск отменён или брошен на паузе"""
+        with self._cond:
+            if len(self.buffer) < self.max_buffer:
+                return True
+            if self.on_pause is not None:
+                self.on_pause()
+                self.released = True
+            while len(self.buffer) >= self.max_buffer and not self._cancel.is_set():
+                wait = None
+                if self.idle_timeout is not None:
+                    wait = self.last_access + self.idle_timeout - time.monotonic()
+                    if wait <= 0:
+                        # Страницы давно не забирали — поиск брошен
+                        self._cancel.set()
+                        break
+                self._cond.wait(wait)
+        if self._cancel.is_set():
+            return False
+        # on_resume может ждать (свободного места в лимите) — не под self._cond
+        if self.released:
+            self.on_resume()
+            self.released = False
+        return True
+
+    def take(self, limit, linger=PAGE_LINGER, timeout=30.0):
+        """Забрать до limit результатов: (страница, всё ли уже отдано).
+
+        Ждёт, пока наберётся limit результатов или поиск закончится, но
+        не дольше linger после появления первого результата.
+        """
+        self.last_access = time.monotonic()
+        deadline = self.last_access + timeout
+        first_seen = None
+        with self._cond:
+            while not self.done and len(self.buffer) < limit:
+                now = time.monotonic()
+                wait = deadline - now
+                if self.buffer:
+                    first_seen = first_seen or now
+                    wait = min(wait, first_seen + linger - now)
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+            page = self.buffer[:limit]
+            del self.buffer[:limit]
+            # В буфере освободилось место для остановленного обхода
+            self._cond.notify_all()
+            return page, self.done and not self.buffer
+
+    def cancel(self):
+        self._cancel.set()
+        with self._cond:
+            self._cond.notify_all()
@@ -2,72 +2,863 @@
 from fastmcp import FastMCP
 import os
 import json
+import fnmatch
+import itertools
+import uuid
+import time
+import stat
+import asyncio
+import functools
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from file_cache import ReadCache
+from file_finder import PathIndex
+from file_hashing import ALGORITHMS, DigestCache, find_duplicates
+from file_encoding import ResponseEncoding
+from file_ignore import EXCLUDES, cancelled, check_cancelled, set_cancel_event
+from file_index import TrigramIndex, iter_dir_entries
+from file_search import (SEARCH_MODES, ResultStream, iter_parallel_search,
+                         query_candidates, search_file)
+from file_stats import stats
+from file_read import PAGE_SIZE, read_range, read_lines
+from file_workspace import Workspace, load_roots
+from file_write import ChunkedUpload, append_text, atomic_write, remove_stale_temps
+
 # Создание MCP сервера
 mcp = FastMCP("Simple File Server")
 
-@mcp.tool()
-def list_files(directory: str = ".") -> str:
-    """Получить список файлов в указанной директории"""
+# Состояние между вызовами инструментов: тёплые индексы директорий
+# (от давно не использованных к недавним) и незавершённые загрузки
+# (upload_id -> ChunkedUpload)
+_indexes = OrderedDict()
+_path_indexes = OrderedDict()
+_uploads = {}
+
+# Сколько тёплых индексов каждого вида держать: сверх этого давно не
+# использованные закрываются (триграммный остаётся на диске)
+MAX_WARM_INDEXES = int(os.environ.get("FILE_SERVER_WARM_INDEXES", 8))
+
+# Загрузка, в которую столько секунд ничего не писали, считается брошенной
+UPLOAD_TTL = float(os.environ.get("FILE_SERVER_UPLOAD_TTL", 3600))
+
+# Незавершённые постраничные поиски: handle -> ResultStream
+MAX_STREAMS = 16
+STREAM_TTL = 300
+_streams = {}
+
+# Постраничные листинги list_files, остановленные на странице:
+# ((директория, depth, pattern), cursor) -> (прочитанные наперёд записи,
+# генератор обхода, время обращения). Следующая страница продолжает
+# обход, а не пропускает cursor записей заново
+MAX_LISTINGS = 16
+LISTING_TTL = 300
+_listings = OrderedDict()
+_listings_lock = threading.Lock()
+
+# Пул потоков для пакетного чтения: ввод-вывод отпускает GIL
+IO_WORKERS = int(os.environ.get("FILE_SERVER_IO_WORKERS", 16))
+_io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS)
+
+# Общий кэш содержимого файлов для read_file, read_many и search_in_files
+_read_cache = ReadCache()
+
+# Дайджесты содержимого для hash_files и find_duplicate_files
+_digest_cache = DigestCache()
+
+# Именованные корни рабочего пространства (FILE_SERVER_ROOTS, FILE_SERVER_WORKSPACE):
+# у каждого свои индексы, кэш и правила игнорирования
+_workspace = Workspace(load_roots())
+
+# Формат ответов, согласованный через negotiate_encoding. У stdio-сервера
+# один клиент, и формат общий для процесса; демон (file_daemon.py --serve)
+# заводит каждому соединению свой через new_session()
+_encoding = ResponseEncoding()
+_session_encoding = contextvars.ContextVar("session_encoding", default=None)
+
+# Рабочая директория клиента демона: относительные пути без root считаются
+# от неё, а не от директории, в которой запущен демон
+_client_cwd = contextvars.ContextVar("client_cwd", default=None)
+
+# Блокирующая работа инструментов выполняется в отдельном пуле потоков,
+# чтобы цикл событий сервера продолжал принимать запросы. Для каждой
+# группы инструментов свой лимит одновременных вызовов: один долгий
+# поиск не может занять все потоки и заблокировать чтение.
+BLOCKING_WORKERS = int(os.environ.get("FILE_SERVER_BLOCKING_WORKERS", 16))
+TOOL_LIMITS = {"list": 4, "read": 8, "write": 4, "search": 2}
+_blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS)
+_tool_semaphores = {group: asyncio.Semaphore(limit) for group, limit in TOOL_LIMITS.items()}
+
+# Словари тёплых индексов меняются из разных потоков. Сами индексы
+# обновляются под своей блокировкой (index.lock), а эта держится только
+# на время поиска в словаре — пока строится индекс одной директории,
+# вызовы для других её не ждут
+_index_lock = threading.Lock()
+
+# Место в лимите группы текущего вызова, видимое из потока, который его выполняет
+_local = threading.local()
+
+
+def encoding():
+    """Формат ответов клиента, чей вызов сейчас выполняется"""
+    session = _session_encoding.get()
+    return _encoding if session is None else session
+
+
+def new_session():
+    """Завести отдельный формат ответов для клиента текущего контекста (задачи asyncio)"""
+    _session_encoding.set(ResponseEncoding())
+
+
+def set_client_cwd(cwd):
+    """Рабочая директория клиента для вызовов текущего контекста (задачи asyncio)"""
+    _client_cwd.set(cwd)
+
+
+def _client_path(path):
+    """Путь клиента без root: относительный — от его рабочей директории"""
+    cwd = _client_cwd.get()
+    return path if cwd is None else os.path.join(cwd, path)
+
+
+def _shown(path, directory, resolved):
+    """Путь из результата в том виде, в каком клиент задал directory"""
+    return path if resolved == directory else directory + path[len(resolved):]
+
+
+def _dumps(obj, **kwargs):
+    """json.dumps в согласованном с клиентом формате, с замером фазы сериализации"""
+    with stats.phase("serialize"):
+        return encoding().dumps(obj, **kwargs)
+
+
+def _map_io(func, items):
+    """_io_pool.map в контексте текущего вызова, чтобы потоки видели формат клиента"""
+    return list(_io_pool.map(lambda context, item: context.run(func, item),
+                             [contextvars.copy_context() for _ in items], items))
+
+
+class _Slot:
+    """Место в лимите группы, занятое одним вызовом.
+
+    Обычно освобождается, когда поток вызова вернулся, — даже если клиент
+    отменил вызов раньше: пока поток работает, место занято. Вызов может
+    передать его фоновой работе (hold_slot()), которая продолжается
+    после ответа, — тогда место освобождает она; на время простоя она
+    может отпустить место и занять его снова.
+    """
+
+    def __init__(self, loop, semaphore):
+        self.loop = loop
+        self.semaphore = semaphore
+        self.handed_over = False
+        self.released = False
+        self.lock = threading.Lock()
+
+    def hand_over(self):
+        with self.lock:
+            if self.released:
+                return None
+            self.handed_over = True
+        return self.release_threadsafe, self.acquire_threadsafe
+
+    def release(self):
+        """Освободить по завершении вызова (из любого потока), если место не передано"""
+        with self.lock:
+            if self.handed_over or self.released:
+                return
+            self.released = True
+        self.release_threadsafe()
+
+    def release_threadsafe(self):
+        """Освободить переданное место из любого потока"""
+        try:
+            self.loop.call_soon_threadsafe(self.semaphore.release)
+        except RuntimeError:
+            # Цикл событий уже закрыт — сервер завершается
+            pass
+
+    def acquire_threadsafe(self):
+        """Снова занять отпущенное место из фонового потока (ждёт свободного)"""
+        asyncio.run_coroutine_threadsafe(self.semaphore.acquire(), self.loop).result()
+
+
+def hold_slot():
+    """Оставить место текущего вызова в лимите группы за фоновой работой.
+
+    Возвращает пару функций (освободить, занять снова) для фоновой работы
+    или None, если вызов уже отменён. Вне run_blocking — пустые функции.
+    """
+    if cancelled():
+        return None
+    slot = getattr(_local, "slot", None)
+    return slot.hand_over() if slot is not None else (lambda: None, lambda: None)
+
+
+async def run_blocking(group, func, *args, **kwargs):
+    """Выполнить func в пуле потоков с учётом лимита группы.
+
+    Если клиент отменил запрос, поток получает флаг отмены
+    (см. cancelled()) и долгие операции завершаются досрочно; место
+    в лимите группы освобождается, только когда поток вернулся. Время ожидания в очереди учитывается в статистике как фаза queue.
+    """
+    cancel = threading.Event()
+    submitted = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    semaphore = _tool_semaphores[group]
+    await semaphore.acquire()
+    slot = _Slot(loop, semaphore)
+
+    def call():
+        set_cancel_event(cancel)
+        _local.slot = slot
+        try:
+            with stats.tool_call(func.__name__, time.perf_counter() - submitted) as outcome:
+                result = func(*args, **kwargs)
+                if isinstance(result, str) and result.startswith("Ошибка"):
+                    outcome["error"] = True
+                return result
+        finally:
+            _local.slot = None
+
+    # Контекст вызова (формат ответов клиента) переходит в поток пула
+    future = _blocking_pool.submit(contextvars.copy_context().run, call)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+    finally:
+        # Отменённый вызов, который поток ещё выполняет, держит место,
+        # пока поток не вернётся; не начатый — снимается с очереди
+        future.cancel()
+        future.add_done_callback(lambda _: slot.release())
+
+
+def blocking_tool(group):
+    """Зарегистрировать синхронную функцию как async-инструмент MCP.
+
+    Синхронная версия остаётся доступной как tool.__wrapped__.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await run_blocking(group, func, *args, **kwargs)
+        return mcp.tool()(wrapper)
+    return decorator
+
+
+def resolve(root, path):
+    """Путь из аргументов инструмента: внутри корня root или от рабочей директории клиента"""
+    return _workspace.get(root).resolve(path) if root else _client_path(path)
+
+
+def cache_for(root):
+    """Кэш чтения корня root или общий кэш"""
+    return _workspace.cache(root) if root else _read_cache
+
+
+def notify_written(path):
+    """Сообщить тёплым индексам о файле, который записал сам сервер.
+
+    Путь только ставится в очередь трекера, поэтому запись не ждёт
+    индексы, которые сейчас строятся.
+    """
+    with _index_lock:
+        indexes = list(itertools.chain(_indexes.values(), _path_indexes.values()))
+    for index in indexes:
+        index.tracker.notify(path)
+    _workspace.notify(path)
+
+
+def _warm_index(indexes, root, create):
+    """Индекс для root из словаря indexes и префикс путей root в нём.
+
+    Тёплый индекс самой root или директории над ней, в которой root не
+    игнорируется, используется с префиксом, как индекс корня рабочего
+    пространства для его поддиректорий. Новый индекс создаётся вне
+    _index_lock.
+    """
+    with _index_lock:
+        ancestors = []
+        path = root
+        while True:
+            if path in indexes:
+                ancestors.append((path, indexes[path]))
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    # Правила игнорирования могут читать .gitignore — вне _index_lock
+    for path, index in ancestors:
+        rel = root[len(path):].lstrip(os.sep)
+        if rel and index.tracker.rules.excluded(rel.replace(os.sep, '/'), True):
+            continue
+        with _index_lock:
+            if path in indexes:
+                indexes.move_to_end(path)
+        return index, rel + os.sep if rel else ''
+    created = create(root)
+    with _index_lock:
+        index = indexes.setdefault(root, created)
+        indexes.move_to_end(root)
+        _evict_indexes(indexes)
+    if index is not created:
+        created.tracker.close()
+    return index, ''
+
+
+def _evict_indexes(indexes):
+    """Закрыть давно не использованные индексы сверх MAX_WARM_INDEXES (под _index_lock).
+
+    Занятые (их обновляет или читает другой вызов) пропускаются, как в Workspace.trim.
+    """
+    for path in list(indexes)[:-1]:
+        if len(indexes) <= MAX_WARM_INDEXES:
+            break
+        index = indexes[path]
+        if not index.lock.acquire(blocking=False):
+            continue
+        try:
+            del indexes[path]
+            index.tracker.close()
+        finally:
+            index.lock.release()
+
+
+def get_index(directory):
+    """Тёплый индекс для директории и префикс её путей в нём.
+
+    Индекс загружается с диска один раз за процесс; для поддиректории
+    уже проиндексированного дерева берётся индекс дерева.
+    """
+    index, prefix = _warm_index(_indexes, os.path.abspath(directory), TrigramIndex.load)
+    with index.lock:
+        if index.refresh():
+            index.save()
+    return index, prefix
+
+
+@blocking_tool("list")
+def list_files(directory: str = ".", limit: int = 0, cursor: int = 0,
+               depth: int = 0, pattern: str = "", root: str = "") -> str:
+    """Получить список файлов в указанной директории.
+
+    depth — глубина рекурсивного обхода (-1 — без ограничения),
+    pattern — glob-фильтр по имени. При limit > 0 возвращается страница
+    {"files": [...], "next_cursor": ...}; обход следующей страницы
+    продолжается с того места, где остановился этот. root — имя корня рабочего
+    пространства, тогда directory задаётся относительно него.
+    """
     try:
+        key = (resolve(root, directory), depth, pattern)
+        resumed = _take_listing(key, cursor) if limit and cursor else None
+        if resumed is None:
+            walk = iter_dir_entries(key[0], depth)
+            if pattern:
+                walk = ((name, entry) for name, entry in walk
+                        if fnmatch.fnmatch(entry.name, pattern))
+            entries, skip = walk, cursor
+        else:
+            entries, walk = resumed
+            skip = 0
+        # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+        stop = skip + limit + 1 if limit else None
+
         files = []
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
+        with stats.phase("walk"):
+            listed = list(itertools.islice(entries, skip, stop))
+        has_more = limit and len(listed) > limit
+        if has_more:
+            _keep_listing(key, cursor + limit, listed[limit:], walk)
+            listed = listed[:limit]
+        for name, entry in listed:
+            # DirEntry кэширует тип из readdir, stat нужен только для размера
+            is_file = entry.is_file()
             file_info = {
-                "name": item,
-                "type": "directory" if os.path.isdir(item_path) else "file",
-                "size": os.path.getsize(item_path) if os.path.isfile(item_path) else 0
+                "name": name,
+                "type": "directory" if entry.is_dir() else "file",
+                "size": entry.stat().st_size if is_file else 0
             }
             files.append(file_info)
-        
-        return json.dumps(files, indent=2)
+
+        if limit:
+            files = {
+                "files": encoding().listing(files),
+                "next_cursor": cursor + limit if has_more else None
+            }
+        else:
+            files = encoding().listing(files)
+        return _dumps(files, ensure_ascii=False, separators=(',', ':'))
     except Exception as e:
         return f"Ошибка: {str(e)}"
 
-@mcp.tool()
-def read_file(filepath: str) -> str:
-    """Прочитать содержимое файла"""
+def _take_listing(key, cursor):
+    """Обход, остановленный прошлой страницей на cursor: (записи, генератор) или None"""
+    with _listings_lock:
+        saved = _listings.pop((key, cursor), None)
+    if saved is None:
+        return None
+    ahead, walk, _ = saved
+    return itertools.chain(ahead, walk), walk
+
+
+def _keep_listing(key, cursor, ahead, walk):
+    """Оставить обход для страницы с cursor и закрыть брошенные или лишние старые"""
+    now = time.monotonic()
+    stale = []
+    with _listings_lock:
+        for old_key, (_, old_walk, last_access) in list(_listings.items()):
+            if now - last_access > LISTING_TTL or len(_listings) >= MAX_LISTINGS:
+                stale.append(old_walk)
+                del _listings[old_key]
+        _listings[(key, cursor)] = (ahead, walk, now)
+    # Закрытие генератора закрывает os.scandir его ветки
+    for old_walk in stale:
+        old_walk.close()
+
+def get_path_index(directory):
+    """Тёплый индекс путей для директории (только в памяти) и префикс её путей в нём"""
+    index, prefix = _warm_index(_path_indexes, os.path.abspath(directory), PathIndex)
+    index.refresh()
+    return index, prefix
+
+@blocking_tool("list")
+def find_files(query: str, directory: str = ".", limit: int = 20, root: str = "") -> str:
+    """Найти файлы по приблизительному имени или пути (нечёткий поиск).
+
+    Учитывает те же правила игнорирования, что и search_in_files.
+    Возвращает до limit лучших совпадений с оценкой. С root пути
+    в ответе относительны корню.
+    """
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return content
+        with stats.phase("walk"):
+            if root:
+                prefix = _workspace.get(root).prefix(directory)
+                found = _workspace.path_index(root).find(query, max(limit, 1), prefix)
+                base = ''
+            else:
+                index, prefix = get_path_index(_client_path(directory))
+                found = [(score, rel_path[len(prefix):])
+                         for score, rel_path in index.find(query, max(limit, 1), prefix)]
+                base = directory
+        return _dumps([
+            {"file": os.path.join(base, rel_path), "score": round(score, 1)}
+            for score, rel_path in found
+        ], ensure_ascii=False)
+    except Exception as e:
+        return f"Ошибка поиска: {str(e)}"
+
+@blocking_tool("read")
+def read_file(filepath: str, offset: int = 0, length: int = 0,
+              start_line: int = 0, end_line: int = 0, root: str = "") -> str:
+    """Прочитать содержимое файла.
+
+    offset/length — диапазон в байтах, start_line/end_line — диапазон строк
+    (с 1, включительно). Без параметров файл читается целиком.
+    root — имя корня рабочего пространства для относительного filepath.
+    """
+    try:
+        text = _read_text(resolve(root, filepath), offset, length, start_line, end_line, cache_for(root))
+        if encoding().compression() is None:
+            return text
+        # Со сжатием ответ — всегда {"content": тело}, чтобы клиент не гадал
+        # по содержимому файла, сжато ли оно
+        return _dumps({"content": encoding().body(text)}, ensure_ascii=False)
     except Exception as e:
         return f"Ошибка чтения файла: {str(e)}"
 
-@mcp.tool()
-def create_file(filepath: str, content: str) -> str:
-    """Создать новый файл с указанным содержимым"""
+
+def _read_text(filepath, offset=0, length=0, start_line=0, end_line=0, cache=None):
+    """Общая часть read_file и read_many; ошибки пробрасываются наверх"""
+    if start_line or end_line:
+        return read_lines(filepath, start_line or 1, end_line or None)
+    if offset or length:
+        return read_range(filepath, offset, length or PAGE_SIZE)[0]
+    return (cache or _read_cache).read_text(filepath)
+
+
+def _read_item(item, root=""):
+    """Прочитать один элемент read_many: путь или словарь с диапазоном"""
+    if isinstance(item, str):
+        item = {"filepath": item}
+    filepath = item.get("filepath")
+    try:
+        check_cancelled()
+        content = _read_text(
+            resolve(root, filepath),
+            item.get("offset", 0), item.get("length", 0),
+            item.get("start_line", 0), item.get("end_line", 0),
+            cache_for(root)
+        )
+        return {"filepath": filepath, "content": encoding().body(content)}
+    except Exception as e:
+        return {"filepath": filepath, "error": str(e)}
+
+
+def _stat_item(filepath, root=""):
+    try:
+        st = os.stat(resolve(root, filepath))
+        return {
+            "filepath": filepath,
+            "type": "directory" if stat.S_ISDIR(st.st_mode) else "file",
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns
+        }
+    except Exception as e:
+        return {"filepath": filepath, "error": str(e)}
+
+@blocking_tool("read")
+def read_many(files: list, root: str = "") -> str:
+    """Прочитать несколько файлов за один вызов.
+
+    Элемент files — путь или словарь {"filepath", "offset", "length",
+    "start_line", "end_line"}. Файлы читаются параллельно, ошибка
+    одного файла не мешает остальным.
+    """
+    try:
+        return _dumps(_map_io(lambda item: _read_item(item, root), files), ensure_ascii=False)
+    except Exception as e:
+        return f"Ошибка чтения файлов: {str(e)}"
+
+@blocking_tool("list")
+def stat_many(paths: list, root: str = "") -> str:
+    """Тип, размер и mtime для нескольких путей за один вызов"""
+    try:
+        return _dumps(_map_io(lambda path: _stat_item(path, root), paths), ensure_ascii=False)
+    except Exception as e:
+        return f"Ошибка: {str(e)}"
+
+@blocking_tool("read")
+def read_file_chunk(filepath: str, cursor: int = 0, page_size: int = PAGE_SIZE,
+                    root: str = "") -> str:
+    """Постраничное чтение файла: страница и курсор для следующего вызова"""
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
+        content, next_offset, eof = read_range(resolve(root, filepath), cursor, max(page_size, 1))
+        return _dumps({
+            "content": encoding().body(content),
+            "next_cursor": None if eof else next_offset,
+            "eof": eof
+        }, ensure_ascii=False)
+    except Exception as e:
+        return f"Ошибка чтения файла: {str(e)}"
+
+@blocking_tool("write")
+def create_file(filepath: str, content: str, mode: str = "write", root: str = "") -> str:
+    """Создать новый файл с указанным содержимым.
+
+    mode: "write" — перезаписать, "atomic" — через временный файл,
+    fsync и rename, "append" — дописать в конец.
+    """
+    try:
+        target = resolve(root, filepath)
+        if mode == "atomic":
+            atomic_write(target, content)
+        elif mode == "append":
+            append_text(target, content)
+            notify_written(target)
+            return f"Данные дописаны в файл {filepath}"
+        elif mode == "write":
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(content)
+        else:
+            return f"Ошибка создания файла: неизвестный режим {mode}"
+        notify_written(target)
         return f"Файл {filepath} успешно создан"
     except Exception as e:
         return f"Ошибка создания файла: {str(e)}"
 
-@mcp.tool()
-def search_in_files(directory: str, search_term: str) -> str:
-    """Поиск текста в файлах директории"""
+def _expire_uploads():
+    """Удалить брошенные загрузки вместе с их временными файлами"""
+    now = time.monotonic()
+    for upload_id, upload in list(_uploads.items()):
+        if now - upload.last_access > UPLOAD_TTL and _uploads.pop(upload_id, None) is not None:
+            upload.abort()
+
+@blocking_tool("write")
+def begin_upload(filepath: str, root: str = "") -> str:
+    """Начать загрузку файла по частям; возвращает upload_id"""
+    try:
+        _expire_uploads()
+        target = resolve(root, filepath)
+        # Временные файлы загрузок этого файла, брошенных до перезапуска
+        remove_stale_temps(target, UPLOAD_TTL)
+        upload_id = uuid.uuid4().hex
+        _uploads[upload_id] = ChunkedUpload(target)
+        return upload_id
+    except Exception as e:
+        return f"Ошибка загрузки: {str(e)}"
+
+@blocking_tool("write")
+def write_chunk(upload_id: str, content: str, offset: int = -1) -> str:
+    """Записать часть загружаемого файла.
+
+    offset — смещение части в байтах UTF-8; с ним части можно отправлять,
+    не дожидаясь ответов, и они лягут на свои места в любом порядке.
+    Часть, пересекающаяся с уже записанной, отклоняется. offset=-1 —
+    дописать за последней записанной частью (только для последовательной
+    отправки).
+    """
+    try:
+        upload = _uploads.get(upload_id)
+        if upload is None:
+            return f"Ошибка загрузки: неизвестный upload_id {upload_id}"
+        start, end = upload.write(content, offset if offset >= 0 else None)
+        return f"Записано символов: {len(content)}, байты {start}–{end}"
+    except Exception as e:
+        return f"Ошибка загрузки: {str(e)}"
+
+@blocking_tool("write")
+def commit_upload(upload_id: str, abort: bool = False) -> str:
+    """Завершить загрузку: атомарно заменить целевой файл (или отменить при abort=True).
+
+    Если между частями есть пропуски, загрузка не завершается и её
+    можно дописать.
+    """
+    try:
+        upload = _uploads.get(upload_id)
+        if upload is None:
+            return f"Ошибка загрузки: неизвестный upload_id {upload_id}"
+        if abort:
+            _uploads.pop(upload_id, None)
+            upload.abort()
+            return f"Загрузка файла {upload.target} отменена"
+        upload.commit()
+        _uploads.pop(upload_id, None)
+        notify_written(upload.target)
+        return f"Файл {upload.target} успешно создан"
+    except Exception as e:
+        return f"Ошибка загрузки: {str(e)}"
+
+@blocking_tool("search")
+def search_in_files(directory: str, search_term: str, use_index: bool = True, workers: int = 0,
+                    mode: str = "literal", max_matches: int = 0,
+                    max_results: int = 0, page_size: int = 0, root: str = "") -> str:
+    """Поиск текста в файлах директории.
+
+    mode: "literal" — подстрока без учёта регистра, "regex" — регулярное
+    выражение, "word" — целое слово, "all"/"any" — все/любое из слов запроса.
+    Во всех режимах, кроме literal, для файла возвращаются строки
+    с совпадениями ("lines"), не больше max_matches (по умолчанию 100).
+    use_index=False — поиск без индекса на пуле из workers процессов
+    (0 — по числу CPU), результаты идут в порядке завершения групп файлов.
+    max_results — остановить поиск после стольких файлов с совпадениями.
+    page_size > 0 — вернуть первую страницу сразу, как только она готова:
+    {"results": [...], "handle": ..., "done": ...}; следующие страницы
+    отдаёт search_results(handle).
+    root — имя корня рабочего пространства: directory задаётся относительно
+    него, а пути в результатах — относительно корня.
+    """
     results = []
     try:
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith(('.txt', '.py', '.md', '.json')):
-                    filepath = os.path.join(root, file)
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            if search_term.lower() in content.lower():
-                                results.append({
-                                    "file": filepath,
-                                    "matches": content.lower().count(search_term.lower())
-                                })
-                    except:
-                        continue
-        
-        return json.dumps(results, indent=2)
+        if mode not in SEARCH_MODES:
+            return f"Ошибка поиска: неизвестный режим {mode}"
+        workspace_root = _workspace.get(root) if root else None
+        if use_index:
+            # Индекс отбирает файлы-кандидаты, содержимое проверяется только у них
+            with stats.phase("walk"):
+                if workspace_root is not None:
+                    prefix = workspace_root.prefix(directory)
+                    candidates = [rel_path for rel_path in query_candidates(
+                        _workspace.index(root), search_term, mode) if rel_path.startswith(prefix)]
+                    base = workspace_root.path
+                else:
+                    base = _client_path(directory)
+                    index, prefix = get_index(base)
+                    candidates = [rel_path[len(prefix):] for rel_path in query_candidates(
+                        index, search_term, mode) if rel_path.startswith(prefix)]
+            cache = cache_for(root)
+            matched = (
+                search_file(os.path.join(base, rel_path), search_term,
+                            mode, max_matches, cache)
+                for rel_path in candidates
+            )
+        else:
+            excludes = workspace_root.excludes if workspace_root is not None else EXCLUDES
+            matched = iter_parallel_search(resolve(root, directory), search_term,
+                                           workers=workers or None, mode=mode,
+                                           max_matches=max_matches, excludes=excludes)
+        found = (result for result in matched if result)
+        if workspace_root is not None:
+            found = (dict(result, file=workspace_root.relative(result["file"])) for result in found)
+        else:
+            resolved = _client_path(directory)
+            found = (dict(result, file=_shown(result["file"], directory, resolved)) for result in found)
+
+        if page_size:
+            # Поиск продолжается после ответа, поэтому место в лимите
+            # группы "search" остаётся за ним до конца обхода; пока буфер
+            # полон и страницы не забирают, место свободно для других
+            held = hold_slot()
+            if held is None:
+                found.close()
+                return "Ошибка поиска: вызов отменён"
+            release, reacquire = held
+            handle = _open_stream(ResultStream(found, max_results, on_done=release,
+                                              on_pause=release, on_resume=reacquire,
+                                              idle_timeout=STREAM_TTL))
+            return _stream_page(handle, page_size)
+
+        for result in found:
+            if cancelled():
+                break
+            results.append(result)
+            if max_results and len(results) >= max_results:
+                break
+        found.close()
+
+        return _dumps(results, indent=2)
+    except Exception as e:
+        return f"Ошибка поиска: {str(e)}"
+
+
+def _expire_streams():
+    """Остановить и забыть поиски, страницы которых давно не забирали"""
+    now = time.monotonic()
+    for handle, stream in list(_streams.items()):
+        if now - stream.last_access > STREAM_TTL:
+            stream.cancel()
+            _streams.pop(handle, None)
+
+
+def _open_stream(stream):
+    """Зарегистрировать поиск и убрать брошенные или лишние старые"""
+    _expire_streams()
+    for handle, old in list(_streams.items()):
+        if len(_streams) < MAX_STREAMS:
+            break
+        old.cancel()
+        _streams.pop(handle, None)
+    handle = uuid.uuid4().hex
+    _streams[handle] = stream
+    return handle
+
+
+def _stream_page(handle, page_size):
+    stream = _streams[handle]
+    page, finished = stream.take(max(page_size, 1))
+    if finished:
+        _streams.pop(handle, None)
+        if stream.error:
+            return f"Ошибка поиска: {stream.error}"
+    return _dumps({
+        "results": page,
+        "handle": None if finished else handle,
+        "done": finished
+    }, indent=2)
+
+@blocking_tool("read")
+def search_results(handle: str, page_size: int = 50, cancel: bool = False) -> str:
+    """Следующая страница результатов поиска, начатого с page_size (cancel=True — прервать)"""
+    try:
+        _expire_streams()
+        if handle not in _streams:
+            return f"Ошибка поиска: неизвестный handle {handle}"
+        if cancel:
+            _streams.pop(handle).cancel()
+            return f"Поиск {handle} остановлен"
+        return _stream_page(handle, page_size)
+    except Exception as e:
+        return f"Ошибка поиска: {str(e)}"
+
+def _hash_item(filepath, algorithm, root=""):
+    try:
+        check_cancelled()
+        return {"filepath": filepath, "digest": _digest_cache.digest(resolve(root, filepath), algorithm)}
+    except Exception as e:
+        return {"filepath": filepath, "error": str(e)}
+
+@blocking_tool("search")
+def hash_files(paths: list, algorithm: str = "blake2b", root: str = "") -> str:
+    """Дайджесты содержимого файлов (blake2b, sha256 или xxh3, если установлен xxhash).
+
+    Файлы хэшируются потоково, результат кэшируется до изменения файла.
+    """
+    try:
+        if algorithm not in ALGORITHMS:
+            return f"Ошибка: неизвестный алгоритм {algorithm}"
+        return _dumps(_map_io(lambda path: _hash_item(path, algorithm, root), paths),
+                      ensure_ascii=False)
+    except Exception as e:
+        return f"Ошибка: {str(e)}"
+
+@blocking_tool("search")
+def find_duplicate_files(directory: str = ".", algorithm: str = "blake2b", min_size: int = 1,
+                         root: str = "") -> str:
+    """Найти файлы с одинаковым содержимым.
+
+    Возвращает группы {"size", "digest", "files", "wasted_bytes"},
+    начиная с тех, что занимают больше всего лишнего места.
+    """
+    try:
+        if not root:
+            resolved = _client_path(directory)
+            groups = find_duplicates(resolved, _digest_cache, _io_pool, algorithm, min_size)
+            for group in groups:
+                group["files"] = [_shown(path, directory, resolved) for path in group["files"]]
+            return _dumps(groups, indent=2, ensure_ascii=False)
+        workspace_root = _workspace.get(root)
+        groups = find_duplicates(workspace_root.resolve(directory), _digest_cache, _io_pool,
+                                 algorithm, min_size, workspace_root.excludes)
+        for group in groups:
+            group["files"] = [workspace_root.relative(path) for path in group["files"]]
+        return _dumps(groups, indent=2, ensure_ascii=False)
     except Exception as e:
         return f"Ошибка поиска: {str(e)}"
 
+@blocking_tool("list")
+def add_root(name: str, path: str, exclude: list = None) -> str:
+    """Добавить (или заменить) именованный корень рабочего пространства.
+
+    exclude — дополнительные шаблоны игнорирования только для этого корня.
+    Индексы корня строятся при первом обращении.
+    """
+    try:
+        path = _client_path(path)
+        _workspace.add(name, path, EXCLUDES + tuple(exclude or ()))
+        return f"Корень {name} добавлен: {os.path.realpath(path)}"
+    except Exception as e:
+        return f"Ошибка: {str(e)}"
+
+@mcp.tool()
+def workspace_roots() -> str:
+    """Корни рабочего пространства: путь, загружен ли, оценка памяти, бюджет и вытеснения"""
+    return json.dumps(_workspace.status(), ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def cache_stats() -> str:
+    """Статистика кэшей чтения: попадания, промахи, вытеснения, объём.
+
+    Верхний уровень — общий кэш (вызовы без root), в "roots" — кэш
+    каждого корня рабочего пространства.
+    """
+    result = _read_cache.stats()
+    result["roots"] = _workspace.cache_stats()
+    return json.dumps(result, ensure_ascii=False)
+
+@mcp.tool()
+def negotiate_encoding(accept: list) -> str:
+    """Согласовать компактный формат ответов.
+
+    accept — возможности, которые понимает клиент: "compact" (JSON без
+    отступов), "columnar" (list_files столбцами), "gzip"/"zstd" (большие
+    тела файлов как {"encoding", "data"} в base64). Со сжатием read_file
+    всегда отвечает JSON {"content": тело}. Возвращает включённые.
+    """
+    return json.dumps({"encoding": encoding().negotiate(accept)})
+
+@mcp.tool()
+def server_stats(format: str = "json") -> str:
+    """Статистика инструментов: вызовы, гистограммы задержек, время по фазам
+    (queue, walk, read, match, serialize), прочитанные байты и открытые файлы.
+    format="prometheus" — текстовый формат Prometheus.
+    """
+    if format == "prometheus":
+        return stats.prometheus()
+    return json.dumps(stats.snapshot(), indent=2)
+
 if __name__ == "__main__":
     mcp.run()
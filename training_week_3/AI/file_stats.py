@@ -0,0 +1,196 @@
+# file_stats.py
+import os
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# FILE_SERVER_STATS=0 отключает сбор статистики: phase() и add_io()
+# тогда сводятся к проверке одного флага
+ENABLED = os.environ.get("FILE_SERVER_STATS", "1") != "0"
+
+# Файл для статистики в текстовом формате Prometheus (не задан — не пишем)
+PROMETHEUS_FILE = os.environ.get("FILE_SERVER_STATS_FILE")
+PROMETHEUS_INTERVAL = 1.0
+
+# Границы корзин гистограммы задержек, секунды
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+_NULL_PHASE = nullcontext()
+
+
+class ToolStats:
+    """Счётчики одного инструмента"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.phases = {}   # фаза -> суммарное время, секунды
+        self.bytes_read = 0
+        self.files_opened = 0
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_sum_s": round(self.latency_sum, 6),
+            "latency_buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in zip(BUCKETS, self.buckets)
+            },
+            "phases_s": {name: round(value, 6) for name, value in self.phases.items()},
+            "bytes_read": self.bytes_read,
+            "files_opened": self.files_opened,
+        }
+
+
+class ServerStats:
+    """Статистика инструментов сервера: вызовы, задержки, фазы и ввод-вывод.
+
+    Инструмент, который выполняется в текущем потоке, задаётся через
+    tool_call(); phase() и add_io() относят замеры к нему. В дочерних
+    процессах поиска инструмент не задан, и замеры там не копятся.
+    """
+
+    def __init__(self, enabled=ENABLED, prometheus_file=PROMETHEUS_FILE):
+        self.enabled = enabled
+        self.prometheus_file = prometheus_file
+        self.tools = {}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._last_dump = 0.0
+
+    def _current(self):
+        name = getattr(self._local, "tool", None)
+        if name is None:
+            return None
+        with self.lock:
+            return self.tools.setdefault(name, ToolStats())
+
+    @contextmanager
+    def tool_call(self, name, queued=0.0):
+        """Замерить вызов инструмента name в текущем потоке.
+
+        Отдаёт словарь outcome: outcome["error"] = True отмечает вызов
+        как ошибочный (инструменты возвращают ошибку строкой, а не исключением).
+        """
+        if not self.enabled:
+            yield {}
+            return
+        self._local.tool = name
+        start = time.perf_counter()
+        outcome = {"error": False}
+        try:
+            yield outcome
+        except BaseException:
+            outcome["error"] = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._local.tool = None
+            with self.lock:
+                tool = self.tools.setdefault(name, ToolStats())
+                tool.calls += 1
+                tool.errors += outcome["error"]
+                tool.latency_sum += elapsed
+                for i, bound in enumerate(BUCKETS):
+                    if elapsed <= bound:
+                        tool.buckets[i] += 1
+                        break
+                if queued:
+                    tool.phases["queue"] = tool.phases.get("queue", 0.0) + queued
+            self._maybe_dump()
+
+    def phase(self, name):
+        """Контекст для замера фазы (walk, read, match, serialize...)"""
+        if not self.enabled:
+            return _NULL_PHASE
+        return self._phase(name)
+
+    @contextmanager
+    def _phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            tool = self._current()
+            if tool is not None:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    tool.phases[name] = tool.phases.get(name, 0.0) + elapsed
+
+    def add_io(self, nbytes, files=1):
+        """Учесть прочитанные байты и открытые файлы"""
+        if not self.enabled:
+            return
+        tool = self._current()
+        if tool is not None:
+            with self.lock:
+                tool.bytes_read += nbytes
+                tool.files_opened += files
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "tools": {name: tool.snapshot() for name, tool in sorted(self.tools.items())},
+            }
+
+    def prometheus(self):
+        """Статистика в текстовом формате Prometheus"""
+        # Строки одной метрики должны идти подряд, поэтому собираем по семействам
+        families = {
+            "file_server_tool_calls_total": ("counter", []),
+            "file_server_tool_errors_total": ("counter", []),
+            "file_server_tool_latency_seconds": ("histogram", []),
+            "file_server_tool_phase_seconds_total": ("counter", []),
+            "file_server_tool_bytes_read_total": ("counter", []),
+            "file_server_tool_files_opened_total": ("counter", []),
+        }
+
+        def sample(family, labels, value, suffix=""):
+            families[family][1].append(f"{family}{suffix}{{{labels}}} {value}")
+
+        with self.lock:
+            for name, tool in sorted(self.tools.items()):
+                label = f'tool="{name}"'
+                sample("file_server_tool_calls_total", label, tool.calls)
+                sample("file_server_tool_errors_total", label, tool.errors)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, tool.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else bound
+                    sample("file_server_tool_latency_seconds", f'{label},le="{le}"', cumulative, "_bucket")
+                sample("file_server_tool_latency_seconds", label, f"{tool.latency_sum:.6f}", "_sum")
+                sample("file_server_tool_latency_seconds", label, tool.calls, "_count")
+                for phase, value in sorted(tool.phases.items()):
+                    sample("file_server_tool_phase_seconds_total", f'{label},phase="{phase}"', f"{value:.6f}")
+                sample("file_server_tool_bytes_read_total", label, tool.bytes_read)
+                sample("file_server_tool_files_opened_total", label, tool.files_opened)
+
+        lines = []
+        for family, (kind, samples) in families.items():
+            lines.append(f"# TYPE {family} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def _maybe_dump(self):
+        """Переписать файл Prometheus не чаще раза в PROMETHEUS_INTERVAL секунд"""
+        if not self.prometheus_file:
+            return
+        now = time.monotonic()
+        if now - self._last_dump < PROMETHEUS_INTERVAL:
+            return
+        self._last_dump = now
+        tmp_path = self.prometheus_file + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, self.prometheus_file)
+        except OSError:
+            pass
+
+
+# Общий объект статистики процесса
+stats = ServerStats()
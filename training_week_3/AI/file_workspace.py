@@ -0,0 +1,271 @@
+# file_workspace.py
+import os
+import sys
+import json
+import time
+import threading
+
+from file_cache import CACHE_BYTES, ReadCache
+from file_finder import PathIndex
+from file_ignore import EXCLUDES
+from file_index import TrigramIndex
+
+# Именованные корни рабочего пространства: "имя=путь,имя=путь"
+ROOTS = os.environ.get("FILE_SERVER_ROOTS", "")
+
+# JSON-файл с корнями и их собственными шаблонами игнорирования:
+# {"roots": {"имя": {"path": "...", "exclude": ["*.log", ...]}}}
+WORKSPACE_FILE = os.environ.get("FILE_SERVER_WORKSPACE")
+
+# Бюджет памяти на индексы и кэши всех загруженных корней
+WORKSPACE_BYTES = int(os.environ.get("FILE_SERVER_WORKSPACE_BYTES", 256 * 1024 * 1024))
+
+
+def load_roots(spec=ROOTS, config_file=WORKSPACE_FILE):
+    """Корни из FILE_SERVER_ROOTS и FILE_SERVER_WORKSPACE: {имя: (путь, excludes)}"""
+    roots = {}
+    for item in spec.split(','):
+        name, sep, path = item.strip().partition('=')
+        if sep and name.strip() and path.strip():
+            roots[name.strip()] = (path.strip(), EXCLUDES)
+    if config_file:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        for name, root in config.get("roots", {}).items():
+            excludes = EXCLUDES + tuple(root.get("exclude", ()))
+            roots[name] = (root["path"], excludes)
+    return roots
+
+
+class WorkspaceRoot:
+    """Один корень: собственные индексы, кэш чтения и правила игнорирования.
+
+    Индексы создаются при первом обращении. unload() сохраняет
+    триграммный индекс на диск и освобождает память, поэтому
+    повторная загрузка — это чтение pickle и stat-обход, а не полная
+    переиндексация.
+    """
+
+    def __init__(self, name, path, excludes=EXCLUDES, cache_bytes=CACHE_BYTES):
+        self.name = name
+        self.path = os.path.realpath(path)
+        self.excludes = excludes
+        self.cache_bytes = cache_bytes
+        self.cache = ReadCache(cache_bytes)
+        self.last_used = 0.0
+        self.loads = 0
+        self._index = None
+        self._path_index = None
+        self._index_bytes = 0
+        self._path_index_bytes = 0
+        # Загрузка, обновление и выгрузка индексов корня
+        self.lock = threading.RLock()
+
+    def resolve(self, path="."):
+        """Абсолютный путь внутри корня; выход за пределы корня — ошибка"""
+        full = os.path.realpath(os.path.join(self.path, path))
+        if full != self.path and not full.startswith(self.path + os.sep):
+            raise ValueError(f"путь {path} вне корня {self.name}")
+        return full
+
+    def relative(self, path):
+        """Путь относительно корня для ответа клиенту"""
+        return os.path.relpath(path, self.path)
+
+    def prefix(self, directory="."):
+        """Префикс относительных путей индекса для поддиректории корня"""
+        rel = self.relative(self.resolve(directory))
+        return '' if rel == '.' else rel + os.sep
+
+    def index(self):
+        """Тёплый триграммный индекс корня"""
+        with self.lock:
+            if self._index is None:
+                self._index = TrigramIndex.load(self.path, excludes=self.excludes)
+                self.loads += 1
+            if self._index.refresh() or not self._index_bytes:
+                self._index.save()
+                self._index_bytes = _trigram_bytes(self._index)
+            self.last_used = time.monotonic()
+            return self._index
+
+    def path_index(self):
+        """Тёплый индекс путей корня для find_files"""
+        with self.lock:
+            if self._path_index is None:
+                self._path_index = PathIndex(self.path, excludes=self.excludes)
+            before = len(self._path_index.ids)
+            self._path_index.refresh()
+            if len(self._path_index.ids) != before or not self._path_index_bytes:
+                self._path_index_bytes = _path_bytes(self._path_index)
+            self.last_used = time.monotonic()
+            return self._path_index
+
+    @property
+    def loaded(self):
+        return self._index is not None or self._path_index is not None or self.cache.size > 0
+
+    def memory(self):
+        """Оценка памяти, занятой индексами и кэшем корня"""
+        return self._index_bytes + self._path_index_bytes + self.cache.size
+
+    def notify(self, path):
+        """Сообщить загруженным индексам корня о файле, записанном сервером"""
+        for index in (self._index, self._path_index):
+            if index is not None:
+                index.tracker.notify(path)
+
+    def unload(self):
+        """Сохранить индекс на диск и освободить память корня"""
+        with self.lock:
+            if self._index is not None:
+                self._index.save()
+                self._index.tracker.close()
+            if self._path_index is not None:
+                self._path_index.tracker.close()
+            self._index = None
+            self._path_index = None
+            self._index_bytes = 0
+            self._path_index_bytes = 0
+            self.cache = ReadCache(self.cache_bytes)
+
+    def status(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "loaded": self.loaded,
+            "memory_bytes": self.memory(),
+            "loads": self.loads,
+            "idle_s": round(time.monotonic() - self.last_used, 1) if self.last_used else None,
+        }
+
+
+def _strings_bytes(strings):
+    return sum(sys.getsizeof(item) for item in strings if item is not None)
+
+
+def _tracker_bytes(tracker):
+    """Память FileTracker.stats без строк путей (они общие с индексом)"""
+    stats = tracker.stats
+    sample = next(iter(stats.values()), None)
+    entry = sys.getsizeof(sample) + sum(map(sys.getsizeof, sample)) if sample else 0
+    return sys.getsizeof(stats) + len(stats) * entry
+
+
+def _trigram_bytes(index):
+    """Память TrigramIndex: postings (словарь, триграммы, массивы id),
+    пути со словарём ids и снимок stat FileTracker
+    """
+    postings = index.postings
+    return (sys.getsizeof(postings) + _strings_bytes(postings)
+            + sum(map(sys.getsizeof, postings.values()))
+            + sys.getsizeof(index.paths) + _strings_bytes(index.paths) + sys.getsizeof(index.ids)
+            + sys.getsizeof(index.binary) + _tracker_bytes(index.tracker))
+
+
+def _path_bytes(index):
+    """Память PathIndex: пути (список id, словарь ids, алфавитный список),
+    имена файлов, массивы id по триграммам и снимок stat FileTracker
+    """
+    total = (sys.getsizeof(index.paths) + _strings_bytes(index.paths) + sys.getsizeof(index.ids)
+             + sys.getsizeof(index.order) + sys.getsizeof(index.name_ids)
+             + sys.getsizeof(index.name_list) + _strings_bytes(index.name_list)
+             + sys.getsizeof(index.name_files) + sum(map(sys.getsizeof, index.name_files))
+             + sys.getsizeof(index._names_text or '') + _tracker_bytes(index.tracker))
+    for postings in (index.postings, index.name_grams):
+        total += sys.getsizeof(postings) + _strings_bytes(postings) + sum(map(sys.getsizeof, postings.values()))
+    return total
+
+
+class Workspace:
+    """Набор именованных корней с общим бюджетом памяти.
+
+    Когда суммарная оценка памяти загруженных корней превышает budget,
+    выгружаются давно не использованные корни (кроме текущего).
+    """
+
+    def __init__(self, roots=None, budget=WORKSPACE_BYTES):
+        self.budget = budget
+        self.roots = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+        for name, (path, excludes) in (roots or {}).items():
+            self.add(name, path, excludes)
+
+    def add(self, name, path, excludes=EXCLUDES):
+        if not os.path.isdir(path):
+            raise ValueError(f"{path} не является директорией")
+        with self.lock:
+            old = self.roots.get(name)
+            if old is not None:
+                old.unload()
+            self.roots[name] = WorkspaceRoot(name, path, excludes, min(CACHE_BYTES, self.budget // 4))
+
+    def get(self, name):
+        root = self.roots.get(name)
+        if root is None:
+            raise ValueError(f"неизвестный корень {name}")
+        return root
+
+    def index(self, name):
+        """Триграммный индекс корня с последующим соблюдением бюджета"""
+        root = self.get(name)
+        index = root.index()
+        self.trim(keep=root)
+        return index
+
+    def cache(self, name):
+        """Кэш чтения корня.
+
+        Бюджет здесь не проверяется: кэш каждого корня и так ограничен
+        четвертью бюджета, а выгрузка идёт вместе с индексами (см. trim()).
+        """
+        root = self.get(name)
+        root.last_used = time.monotonic()
+        return root.cache
+
+    def path_index(self, name):
+        root = self.get(name)
+        index = root.path_index()
+        self.trim(keep=root)
+        return index
+
+    def notify(self, path):
+        with self.lock:
+            roots = list(self.roots.values())
+        for root in roots:
+            root.notify(path)
+
+    def trim(self, keep=None):
+        """Выгружать корни в порядке давности использования, пока не уложимся в бюджет"""
+        with self.lock:
+            loaded = sorted((root for root in self.roots.values() if root.loaded and root is not keep),
+                            key=lambda root: root.last_used)
+            total = sum(root.memory() for root in self.roots.values())
+            for root in loaded:
+                if total <= self.budget:
+                    break
+                # Корень, чей индекс сейчас строится другим вызовом, не ждём
+                if not root.lock.acquire(blocking=False):
+                    continue
+                try:
+                    total -= root.memory()
+                    root.unload()
+                    self.evictions += 1
+                finally:
+                    root.lock.release()
+
+    def cache_stats(self):
+        """Статистика кэшей чтения корней: {имя: stats()}; выгрузка корня её обнуляет"""
+        with self.lock:
+            return {name: root.cache.stats() for name, root in self.roots.items()}
+
+    def status(self):
+        with self.lock:
+            roots = [root.status() for root in self.roots.values()]
+        return {
+            "budget_bytes": self.budget,
+            "memory_bytes": sum(root["memory_bytes"] for root in roots),
+            "evictions": self.evictions,
+            "roots": roots,
+        }
@@ -0,0 +1,156 @@
+# file_write.py
+import os
+import re
+import time
+import bisect
+import tempfile
+import threading
+
+
+def temp_path_for(filepath):
+    """Создать пустой временный файл рядом с filepath (та же файловая система)"""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(filepath)}.", suffix=".tmp", dir=directory
+    )
+    os.close(fd)
+    # mkstemp создаёт файл с правами 0600 — берём права заменяемого файла
+    try:
+        mode = os.stat(filepath).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    os.chmod(tmp_path, mode)
+    return tmp_path
+
+
+def remove_stale_temps(filepath, max_age):
+    """Удалить временные файлы temp_path_for(filepath), не менявшиеся дольше max_age секунд.
+
+    Их оставляют загрузки, брошенные до перезапуска сервера: новый
+    процесс о них не знает. Возвращает число удалённых файлов.
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    # Имя mkstemp: prefix, 8 случайных символов [a-z0-9_] и suffix
+    pattern = re.compile(re.escape(f".{os.path.basename(filepath)}.") + r"[a-z0-9_]{8}\.tmp")
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return 0
+    with entries:
+        for entry in entries:
+            if not pattern.fullmatch(entry.name):
+                continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
+
+
+def _fsync_dir(directory):
+    """Сбросить на диск запись директории (на Windows не поддерживается)"""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit_temp(tmp_path, filepath):
+    """fsync временного файла и атомарная замена им filepath"""
+    with open(tmp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+    _fsync_dir(os.path.dirname(os.path.abspath(filepath)))
+
+
+def atomic_write(filepath, content):
+    """Записать файл целиком: при сбое остаётся либо старая, либо новая версия"""
+    tmp_path = temp_path_for(filepath)
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        commit_temp(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def append_text(filepath, content):
+    """Дописать текст в конец файла"""
+    with open(filepath, 'a', encoding='utf-8') as f:
+        f.write(content)
+
+
+class ChunkedUpload:
+    """Загрузка файла частями во временный файл рядом с целевым.
+
+    Каждая часть пишется по своему смещению в байтах UTF-8, поэтому части
+    могут приходить в любом порядке. Часть, пересекающаяся с уже
+    записанной, отклоняется (повтор той же самой части допускается).
+    Зафиксировать можно только файл без пропусков.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.tmp_path = temp_path_for(target)
+        self.ranges = []   # отсортированные диапазоны (начало, конец) записанных байт
+        self.last_access = time.monotonic()
+        self.lock = threading.Lock()
+
+    def write(self, content, offset=None):
+        """Записать часть по offset (None — за последней записанной); вернуть (начало, конец)"""
+        data = content.encode('utf-8')
+        with self.lock:
+            self.last_access = time.monotonic()
+            if offset is None:
+                offset = self.ranges[-1][1] if self.ranges else 0
+            if offset < 0:
+                raise ValueError(f"отрицательное смещение {offset}")
+            span = (offset, offset + len(data))
+            if not data:
+                return span
+            pos = bisect.bisect_left(self.ranges, span)
+            retry = pos < len(self.ranges) and self.ranges[pos] == span
+            if not retry:
+                for other in self.ranges[max(pos - 1, 0):pos + 1]:
+                    if other[0] < span[1] and span[0] < other[1]:
+                        raise ValueError(f"часть {span[0]}–{span[1]} пересекается "
+                                         f"с уже записанной {other[0]}–{other[1]}")
+            with open(self.tmp_path, 'r+b') as f:
+                f.seek(offset)
+                f.write(data)
+            if not retry:
+                self.ranges.insert(pos, span)
+            return span
+
+    def gaps(self):
+        """Пропущенные диапазоны байт между записанными частями"""
+        missing = []
+        end = 0
+        for start, stop in self.ranges:
+            if start > end:
+                missing.append((end, start))
+            end = max(end, stop)
+        return missing
+
+    def commit(self):
+        """Атомарно заменить целевой файл; при пропусках — ValueError"""
+        with self.lock:
+            missing = self.gaps()
+            if missing:
+                raise ValueError("не хватает частей: " + ", ".join(f"{a}–{b}" for a, b in missing))
+            commit_temp(self.tmp_path, self.target)
+
+    def abort(self):
+        """Удалить временный файл"""
+        with self.lock:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
@@ -0,0 +1,137 @@
+# intent_router.py
+import re
+import json
+
+# Сколько строк листинга и результатов поиска показывать в локальном ответе
+LOCAL_MAX_ITEMS = 50
+
+# Сколько символов файла показывать в локальном ответе
+LOCAL_PREVIEW_CHARS = 4000
+
+_FLAGS = re.IGNORECASE
+
+# Путь: в кавычках или слово, похожее на путь (есть точка или слэш)
+_PATH = r"""(?:["'«“](?P<quoted>[^"'«»“”]+)["'»”]|(?P<path>[^\s"'«»]*[./\\][^\s"'«»]*))"""
+
+# Искомый текст: в кавычках или одно слово (но не "файл", иначе это поиск файла по имени)
+_TERM = r"""(?:["'«“](?P<quoted>[^"'«»“”]+)["'»”]|(?!файл|file)(?P<term>[^\s"'«»]+))"""
+
+# Аргументы, которые локально не разобрать: ключ командной строки (ls -la)
+# и URL (open https://example.com) — такие запросы уходят модели
+_FLAG = re.compile(r"^-")
+_URL = re.compile(r"^(?:[a-z][a-z0-9+.-]*://|www\.)", _FLAGS)
+
+# Искомое слово с точкой или слэшем — скорее имя файла (find main.py),
+# а не текст в файлах
+_PATH_LIKE = re.compile(r"[./\\]")
+
+_RU_DIR = (r"(?:\s+(?:в|во)\s+(?:(?:текущей|этой)\s+(?:папке|директории|каталоге)"
+           r"|(?:папке|директории|каталоге)\s+(?P<dir>\S+)))?")
+_EN_DIR = (r"(?:\s+in\s+(?:the\s+|this\s+)?(?:current\s+(?:directory|folder|dir)"
+           r"|(?:directory|folder|dir)\s+(?P<dir>\S+)))?")
+
+# (инструмент, регулярное выражение) — проверяются по порядку
+RULES = [
+    ("list_files", re.compile(
+        r"^(?:покажи|показать|выведи|перечисли|отобрази|дай)(?:\s+мне)?(?:\s+(?:все|список))?"
+        r"\s+файл(?:ы|ов)" + _RU_DIR + "$", _FLAGS)),
+    ("list_files", re.compile(
+        r"^(?:список|какие)\s+файл(?:ов|ы)(?:\s+есть)?" + _RU_DIR + "$", _FLAGS)),
+    ("list_files", re.compile(
+        r"^(?:show|list|display)(?:\s+me)?(?:\s+(?:all|the))*\s+files" + _EN_DIR + "$", _FLAGS)),
+    ("list_files", re.compile(r"^(?:ls|dir)(?:\s+(?P<dir>\S+))?$", _FLAGS)),
+    ("read_file", re.compile(
+        r"^(?:прочитай|прочти|открой|покажи|выведи)(?:\s+мне)?(?:\s+содержимое)?(?:\s+файла?)?"
+        r"\s+" + _PATH + "$", _FLAGS)),
+    ("read_file", re.compile(
+        r"^(?:read|open|cat|show)(?:\s+me)?(?:\s+the)?(?:\s+contents?\s+of)?(?:\s+(?:the\s+)?file)?"
+        r"\s+" + _PATH + "$", _FLAGS)),
+    ("search_in_files", re.compile(
+        r"^(?:найди|найти|поищи|ищи|искать)(?:\s+(?:слово|текст|строку|фразу))?\s+" + _TERM +
+        r"(?:\s+в\s+(?:файлах|тексте\s+файлов))?" + _RU_DIR + "$", _FLAGS)),
+    ("search_in_files", re.compile(
+        r"^(?:find|search(?:\s+for)?|grep|look\s+for)(?:\s+(?:the\s+)?(?:word|text|string|phrase))?"
+        r"\s+" + _TERM + r"(?:\s+in\s+(?:all\s+)?files)?" + _EN_DIR + "$", _FLAGS)),
+]
+
+
+def route(user_input):
+    """План {"tool", "arguments", "explanation"} для очевидного запроса или None.
+
+    Понимает простые команды на русском и английском: показать файлы,
+    прочитать файл, найти текст. Всё остальное — None, и запрос
+    разбирает модель: в том числе команды с ключами, URL и поиск
+    слова, похожего на имя файла.
+    """
+    text = " ".join(user_input.split()).rstrip(" .?!")
+    for tool, pattern in RULES:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        unquoted = [groups.get(name) for name in ("path", "term", "dir") if groups.get(name)]
+        if any(_FLAG.match(value) for value in unquoted):
+            return None
+        if any(_URL.match(value) for value in groups.values() if value):
+            return None
+        if tool == "search_in_files" and groups.get("term") and _PATH_LIKE.search(groups["term"]):
+            return None
+        directory = groups.get("dir") or "."
+        if tool == "list_files":
+            return {"tool": tool, "arguments": {"directory": directory},
+                    "explanation": f"Показываю файлы в директории {directory}"}
+        if tool == "read_file":
+            filepath = groups.get("quoted") or groups.get("path")
+            return {"tool": tool, "arguments": {"filepath": filepath},
+                    "explanation": f"Читаю файл {filepath}"}
+        term = groups.get("quoted") or groups.get("term")
+        return {"tool": tool, "arguments": {"directory": directory, "search_term": term},
+                "explanation": f"Ищу '{term}' в файлах директории {directory}"}
+    return None
+
+
+def listing_rows(data):
+    """Строки листинга list_files в любом из форматов ответа сервера"""
+    if isinstance(data, dict) and "files" in data:
+        data = data["files"]
+    if isinstance(data, dict):
+        # Столбцы {"name": [...], "type": [...], "size": [...]}
+        return [dict(zip(data, values)) for values in zip(*data.values())]
+    return data
+
+
+def _more(total):
+    return [f"… и ещё {total - LOCAL_MAX_ITEMS}"] if total > LOCAL_MAX_ITEMS else []
+
+
+def format_result(plan, result):
+    """Ответ пользователю без обращения к модели"""
+    if result.startswith("Ошибка"):
+        return f"❌ {result}"
+    arguments = plan["arguments"]
+    tool = plan["tool"]
+
+    if tool == "read_file":
+        text = result
+        if len(text) > LOCAL_PREVIEW_CHARS:
+            text = text[:LOCAL_PREVIEW_CHARS] + f"\n… (показано {LOCAL_PREVIEW_CHARS} из {len(result)} символов)"
+        return f"📄 Содержимое файла {arguments['filepath']}:\n{text}"
+
+    data = json.loads(result)
+    if tool == "list_files":
+        rows = listing_rows(data)
+        if not rows:
+            return f"📁 Директория {arguments['directory']} пуста"
+        lines = [
+            f"- {row['name']}/" if row.get("type") == "directory" else f"- {row['name']} ({row.get('size', 0)} байт)"
+            for row in rows[:LOCAL_MAX_ITEMS]
+        ]
+        return "\n".join([f"📁 В директории {arguments['directory']} элементов: {len(rows)}"]
+                         + lines + _more(len(rows)))
+
+    # search_in_files
+    term = arguments["search_term"]
+    if not data:
+        return f"🔍 '{term}' не найдено"
+    lines = [f"- {item['file']}: совпадений {item['matches']}" for item in data[:LOCAL_MAX_ITEMS]]
+    return "\n".join([f"🔍 '{term}' найдено в файлах: {len(data)}"] + lines + _more(len(data)))
@@ -0,0 +1,150 @@
+# plan_cache.py
+import os
+import copy
+import time
+import string
+import threading
+from collections import OrderedDict
+
+# Размер кэша планов и время жизни плана в секундах
+PLAN_CACHE_SIZE = int(os.environ.get("AGENT_PLAN_CACHE_SIZE", 256))
+PLAN_CACHE_TTL = float(os.environ.get("AGENT_PLAN_CACHE_TTL", 600))
+
+# AGENT_PLAN_CACHE_SIGNATURE=1 — дополнительно отбрасывать слова вежливости,
+# чтобы "покажи, пожалуйста, файлы" и "покажи файлы" давали один план
+PLAN_CACHE_SIGNATURE = os.environ.get("AGENT_PLAN_CACHE_SIGNATURE", "0") == "1"
+
+# Слова, которые не меняют смысл запроса к файлам
+FILLER_WORDS = frozenset({
+    "пожалуйста", "плиз", "мне", "можешь", "можно", "будь", "добр", "добра",
+    "please", "pls", "can", "could", "you", "would", "kindly", "me",
+})
+
+# Знаки препинания снимаются только по краям слов: точка в "a.txt" значима
+PUNCTUATION = string.punctuation + "«»„“”‘’…—–"
+
+
+def normalize_request(text, signature=False):
+    """Ключ кэша: нижний регистр, ё -> е, слова без краевой пунктуации.
+
+    signature=True — ещё и без слов из FILLER_WORDS. Порядок слов
+    сохраняется: "скопируй a в b" и "скопируй b в a" — разные планы.
+    """
+    words = []
+    for word in text.lower().replace('ё', 'е').split():
+        word = word.strip(PUNCTUATION)
+        if word and not (signature and word in FILLER_WORDS):
+            words.append(word)
+    return " ".join(words)
+
+
+def _argument_strings(value):
+    """Все строковые значения в аргументах плана (со вложенными списками и словарями)"""
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _argument_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _argument_strings(item)
+    elif isinstance(value, str):
+        yield value
+
+
+def plan_literals(plan, user_input):
+    """Фрагменты запроса, попавшие в аргументы плана, в написании пользователя.
+
+    Ключ кэша не различает регистр и ё/е, а пути и искомый текст
+    различают: план подходит другому запросу, только если эти фрагменты
+    встречаются в нём дословно. Ссылки {{id}} и значения, которых нет
+    в запросе (например, "."), не учитываются.
+    """
+    text = " ".join(user_input.split())
+    folded = text.lower().replace('ё', 'е')
+    literals = set()
+    for step in plan.get("steps") or [plan]:
+        for value in _argument_strings(step.get("arguments") or {}):
+            if "{{" in value or not normalize_request(value):
+                continue
+            pos = folded.find(value.lower().replace('ё', 'е'))
+            if pos >= 0 and len(folded) == len(text):
+                literals.add(text[pos:pos + len(value)])
+    return tuple(sorted(literals))
+
+
+class PlanCache:
+    """LRU-кэш планов analyze_request с временем жизни записей.
+
+    План — словарь {"tool", "arguments", "explanation"} или
+    {"steps", "explanation"}; наружу отдаётся копия, чтобы вызывающий
+    код не испортил запись. Запрос, совпавший по ключу, но написанный
+    иначе в аргументах плана (см. plan_literals), — промах.
+    """
+
+    def __init__(self, max_entries=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL, signature=PLAN_CACHE_SIGNATURE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.signature = signature
+        self.entries = OrderedDict()   # ключ -> (момент устаревания, план, фрагменты запроса)
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = 0
+        self.evictions = 0
+        self.expired = 0
+        self.lock = threading.Lock()
+
+    def key(self, user_input):
+        return normalize_request(user_input, self.signature)
+
+    def get(self, user_input):
+        """План для запроса или None"""
+        key = self.key(user_input)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is not None:
+                text = " ".join(user_input.split())
+                if any(literal not in text for literal in entry[2]):
+                    self.mismatches += 1
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, user_input, plan):
+        """Запомнить план; неудачные планы (без инструментов) не кэшируются"""
+        if not plan or not (plan.get("tool") or plan.get("steps")):
+            return
+        key = self.key(user_input)
+        literals = plan_literals(plan, user_input)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(plan), literals)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "mismatches": self.mismatches,
+                "entries": len(self.entries),
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl
+            }
@@ -0,0 +1,148 @@
+# plan_executor.py
+import re
+import json
+import asyncio
+
+# Ссылка на результат другого шага: {{id}} или {{id.путь.к.полю}}
+PLACEHOLDER = re.compile(r"\{\{\s*([\w-]+)((?:\.[\w-]+)*)\s*\}\}")
+
+# Сколько шагов допускается в одном плане
+MAX_STEPS = 16
+
+
+class StepFailed(Exception):
+    """Шаг не выполнен (ошибка инструмента или зависимости)"""
+
+
+def plan_steps(plan):
+    """Шаги плана: {"steps": [...]} или прежний формат с одним "tool".
+
+    Каждый шаг — {"id", "tool", "arguments", "depends_on"}; зависимости
+    берутся из depends_on и из ссылок {{id}} в аргументах. Ошибки
+    в структуре плана — ValueError.
+    """
+    if plan.get("steps"):
+        raw_steps = plan["steps"]
+    elif plan.get("tool"):
+        raw_steps = [{"id": "step1", "tool": plan["tool"], "arguments": plan.get("arguments") or {}}]
+    else:
+        return []
+    if len(raw_steps) > MAX_STEPS:
+        raise ValueError(f"слишком много шагов: {len(raw_steps)} (не больше {MAX_STEPS})")
+
+    steps = {}
+    for number, raw in enumerate(raw_steps, 1):
+        step_id = str(raw.get("id") or f"step{number}")
+        if step_id in steps:
+            raise ValueError(f"повторяющийся id шага {step_id}")
+        if not raw.get("tool"):
+            raise ValueError(f"у шага {step_id} нет инструмента")
+        arguments = raw.get("arguments") or {}
+        depends_on = set(raw.get("depends_on") or ())
+        # ensure_ascii=False: иначе id шага кириллицей ({{чтение}}) превратится в \uXXXX
+        depends_on.update(match.group(1) for match in PLACEHOLDER.finditer(
+            json.dumps(arguments, ensure_ascii=False)))
+        steps[step_id] = {"id": step_id, "tool": raw["tool"], "arguments": arguments,
+                          "depends_on": sorted(depends_on)}
+
+    for step in steps.values():
+        for dep in step["depends_on"]:
+            if dep not in steps:
+                raise ValueError(f"шаг {step['id']} ссылается на неизвестный шаг {dep}")
+    _check_acyclic(steps)
+    return list(steps.values())
+
+
+def _check_acyclic(steps):
+    state = {}   # id -> 1 (в обходе) или 2 (проверен)
+
+    def visit(step_id):
+        if state.get(step_id) == 2:
+            return
+        if state.get(step_id) == 1:
+            raise ValueError(f"в плане цикл через шаг {step_id}")
+        state[step_id] = 1
+        for dep in steps[step_id]["depends_on"]:
+            visit(dep)
+        state[step_id] = 2
+
+    for step_id in steps:
+        visit(step_id)
+
+
+def _lookup(result, path):
+    """Поле JSON-результата шага по пути вида .0.file"""
+    value = json.loads(result)
+    for key in path:
+        value = value[int(key)] if isinstance(value, list) else value[key]
+    return value
+
+
+def resolve_arguments(value, results):
+    """Подставить результаты шагов вместо ссылок {{id}} в аргументах.
+
+    Если строка целиком состоит из одной ссылки, подставляется само
+    значение (список, число...), иначе — его текст внутри строки.
+    """
+    if isinstance(value, dict):
+        return {key: resolve_arguments(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_arguments(item, results) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    def substitute(match):
+        if match.group(1) not in results:
+            raise StepFailed(f"нет результата шага {match.group(1)}")
+        result = results[match.group(1)]
+        path = match.group(2).split('.')[1:]
+        try:
+            return _lookup(result, path) if path else result
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise StepFailed(f"в результате шага {match.group(1)} нет поля {match.group(2)[1:]}")
+
+    def as_text(match):
+        found = substitute(match)
+        return found if isinstance(found, str) else json.dumps(found, ensure_ascii=False)
+
+    whole = PLACEHOLDER.fullmatch(value)
+    if whole is not None:
+        return substitute(whole)
+    return PLACEHOLDER.sub(as_text, value)
+
+
+async def execute_plan(steps, call_tool):
+    """Выполнить шаги; независимые идут одновременно.
+
+    call_tool(tool, arguments) — корутина, возвращающая текст результата.
+    Возвращает {id: результат}; для шага, который не удалось выполнить,
+    результат — текст ошибки, а зависящие от него шаги пропускаются.
+    """
+    results = {}
+    failed = set()
+    tasks = {}
+
+    async def run(step):
+        for dep in step["depends_on"]:
+            await tasks[dep]
+        try:
+            broken = [dep for dep in step["depends_on"] if dep in failed]
+            if broken:
+                raise StepFailed(f"пропущен: не выполнен шаг {', '.join(broken)}")
+            result = await call_tool(step["tool"], resolve_arguments(step["arguments"], results))
+            if result.startswith("Ошибка"):
+                failed.add(step["id"])
+        except Exception as e:
+            failed.add(step["id"])
+            result = f"Ошибка: {str(e)}"
+        results[step["id"]] = result
+
+    for step in steps:
+        tasks[step["id"]] = asyncio.ensure_future(run(step))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        # Если отменили весь запрос, оставшиеся шаги тоже не нужны
+        for task in tasks.values():
+            task.cancel()
+    return results
@@ -0,0 +1,175 @@
+# result_budget.py
+import os
+import json
+from collections import Counter
+
+from intent_router import listing_rows
+
+# Сколько токенов результатов инструментов можно отдать в итоговый запрос к модели
+RESULT_TOKENS = int(os.environ.get("AGENT_RESULT_TOKENS", 4000))
+
+# Доля бюджета на начало текста при усечении (остальное — на конец)
+HEAD_SHARE = 0.7
+
+# Сколько символов оставлять вокруг совпадения в строке результата поиска
+SNIPPET_CHARS = 60
+
+# Сколько строк с совпадениями показывать на файл
+LINES_PER_FILE = 3
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов: ~4 символа латиницы или ~2 кириллицы на токен"""
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii // 2 + 1
+
+
+def _chars_for(text, tokens):
+    """Сколько символов text укладывается примерно в tokens токенов"""
+    total = estimate_tokens(text)
+    return len(text) if total <= tokens else max(int(len(text) * tokens / total), 0)
+
+
+def truncate_middle(text, tokens):
+    """Начало и конец текста в пределах бюджета, середина заменяется пометкой.
+
+    Границы по возможности сдвигаются к переводам строк.
+    """
+    if estimate_tokens(text) <= tokens:
+        return text
+    chars = _chars_for(text, tokens)
+    head_end = int(chars * HEAD_SHARE)
+    tail_start = len(text) - (chars - head_end)
+    newline = text.rfind('\n', 0, head_end)
+    if newline > head_end // 2:
+        head_end = newline
+    newline = text.find('\n', tail_start)
+    if 0 <= newline < tail_start + (len(text) - tail_start) // 2:
+        tail_start = newline + 1
+    skipped = estimate_tokens(text[head_end:tail_start])
+    return f"{text[:head_end]}\n… [пропущено ~{skipped} токенов] …\n{text[tail_start:]}"
+
+
+def _centre(line, term):
+    """Фрагмент строки вокруг первого вхождения term"""
+    if len(line) <= SNIPPET_CHARS:
+        return line
+    pos = line.lower().find(term.lower()) if term else -1
+    if pos < 0:
+        return line[:SNIPPET_CHARS] + "…"
+    start = max(pos - (SNIPPET_CHARS - len(term)) // 2, 0)
+    end = min(start + SNIPPET_CHARS, len(line))
+    return ("…" if start else "") + line[start:end] + ("…" if end < len(line) else "")
+
+
+def compact_search(results, term, tokens):
+    """Результат search_in_files: файлы по убыванию совпадений, фрагменты вокруг совпадений"""
+    if isinstance(results, dict):
+        # Постраничный ответ {"results", "handle", "done"}
+        results = results.get("results", [])
+    ordered = sorted(results, key=lambda item: -item.get("matches", 0))
+    first_term = term.split()[0] if term and term.split() else term
+    lines, used = [], 0
+    for shown, item in enumerate(ordered):
+        entry = [f"{item['file']}: совпадений {item.get('matches', 0)}"]
+        for hit in item.get("lines", [])[:LINES_PER_FILE]:
+            entry.append(f"  {hit['line']}: {_centre(hit['text'], first_term)}")
+        cost = estimate_tokens("\n".join(entry))
+        if lines and used + cost > tokens:
+            rest = ordered[shown:]
+            lines.append(f"… ещё файлов: {len(rest)}, совпадений: {sum(i.get('matches', 0) for i in rest)}")
+            break
+        lines.extend(entry)
+        used += cost
+    return "\n".join(lines) if lines else "Совпадений нет"
+
+
+def compact_listing(data, tokens):
+    """Результат list_files: директории и файлы строками, хвост — сводкой по расширениям"""
+    rows = listing_rows(data)
+    lines, used = [], 0
+    for shown, row in enumerate(rows):
+        line = f"{row['name']}/" if row.get("type") == "directory" else f"{row['name']} {row.get('size', 0)}B"
+        cost = estimate_tokens(line)
+        if used + cost > tokens:
+            rest = rows[shown:]
+            kinds = Counter(
+                "директории" if row.get("type") == "directory"
+                else (os.path.splitext(row["name"])[1] or "без расширения")
+                for row in rest
+            )
+            summary = ", ".join(f"{kind} {count}" for kind, count in kinds.most_common(8))
+            lines.append(f"… ещё {len(rest)}: {summary}")
+            break
+        lines.append(line)
+        used += cost
+    if isinstance(data, dict) and data.get("next_cursor") is not None:
+        lines.append(f"(есть продолжение, cursor={data['next_cursor']})")
+    return "\n".join(lines)
+
+
+def compact_many(items, tokens):
+    """Результат read_many: бюджет делится поровну между файлами"""
+    share = max(tokens // max(len(items), 1), 1)
+    parts = []
+    for item in items:
+        body = item.get("content") if "content" in item else f"Ошибка: {item.get('error')}"
+        if not isinstance(body, str):
+            body = json.dumps(body, ensure_ascii=False)
+        parts.append(f"== {item.get('filepath')} ==\n{truncate_middle(body, share)}")
+    return "\n".join(parts)
+
+
+def compact_result(tool, arguments, result, tokens):
+    """Сократить результат инструмента до ~tokens токенов с учётом его формата"""
+    if estimate_tokens(result) <= tokens or result.startswith("Ошибка"):
+        return result
+    try:
+        if tool == "search_in_files" or tool == "search_results":
+            return compact_search(json.loads(result), arguments.get("search_term", ""), tokens)
+        if tool == "list_files":
+            return compact_listing(json.loads(result), tokens)
+        if tool == "read_many":
+            return compact_many(json.loads(result), tokens)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return truncate_middle(result, tokens)
+
+
+def _shares(sizes, budget):
+    """Бюджет каждому результату: малые получают сколько нужно, остаток делят крупные"""
+    shares = {}
+    remaining = dict(sizes)
+    left = budget
+    while remaining:
+        fair = left // len(remaining)
+        small = {key: size for key, size in remaining.items() if size <= fair}
+        if not small:
+            for key in remaining:
+                shares[key] = max(fair, 1)
+            break
+        for key, size in small.items():
+            shares[key] = size
+            left -= size
+            del remaining[key]
+    return shares
+
+
+def compact_results(steps, results, budget=RESULT_TOKENS):
+    """Сократить результаты шагов плана под общий бюджет токенов.
+
+    Возвращает ({id: текст}, отчёт {"tokens_before", "tokens_after", "tokens_saved"}).
+    """
+    sizes = {step["id"]: estimate_tokens(results[step["id"]]) for step in steps}
+    shares = _shares(sizes, budget)
+    compacted = {
+        step["id"]: compact_result(step["tool"], step["arguments"], results[step["id"]], shares[step["id"]])
+        for step in steps
+    }
+    before = sum(sizes.values())
+    after = sum(estimate_tokens(text) for text in compacted.values())
+    return compacted, {
+        "tokens_before": before,
+        "tokens_after": after,
+        "tokens_saved": max(before - after, 0)
+    }
@@ -1,20 +1,55 @@
 # simple_agent.py
+import os
+import argparse
 import asyncio
 import json
-from anthropic import Anthropic
+import httpx
+from anthropic import AsyncAnthropic
 from mcp import ClientSession, StdioServerParameters
 
+from file_encoding import FEATURES, decode_response
+from intent_router import format_result, route
+from plan_cache import PlanCache
+from plan_executor import execute_plan, plan_steps
+from result_budget import compact_results
+
+# Таймаут одного обращения к API и размер общего пула соединений
+LLM_TIMEOUT = float(os.environ.get("AGENT_LLM_TIMEOUT", 60))
+LLM_MAX_CONNECTIONS = int(os.environ.get("AGENT_LLM_MAX_CONNECTIONS", 10))
+
+# Сколько запросов пользователя обрабатывать одновременно и сколько
+# секунд даётся одному запросу целиком (план, инструмент и ответ)
+REQUEST_CONCURRENCY = int(os.environ.get("AGENT_CONCURRENCY", 4))
+REQUEST_TIMEOUT = float(os.environ.get("AGENT_REQUEST_TIMEOUT", 120))
+
 class SimpleFileAgent:
-    def __init__(self, anthropic_api_key):
-        self.anthropic = Anthropic(api_key=anthropic_api_key)
+    def __init__(self, anthropic_api_key, plan_cache=None):
+        # Асинхронный клиент не блокирует цикл событий, а соединения
+        # с API переиспользуются всеми одновременными запросами
+        self.anthropic = AsyncAnthropic(
+            api_key=anthropic_api_key,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+            http_client=httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS
+            ))
+        )
         self.mcp_session = None
         self.conversation_history = []
+        # Возможности формата ответов, которые включил сервер
+        self.encoding = []
+        # Планы уже разобранных запросов: повторный запрос не идёт в API
+        self.plan_cache = plan_cache if plan_cache is not None else PlanCache()
+        # Сколько токенов сэкономило сокращение результатов инструментов
+        self.tokens_saved = 0
     
     async def connect_to_mcp_server(self):
         """Подключение к MCP серверу"""
+        # file_daemon.py отвечает на list_tools, не дожидаясь импорта сервера,
+        # и подключается к демону (file_daemon.py --serve), если тот запущен
         server_params = StdioServerParameters(
             command="python",
-            args=["file_server.py"]
+            args=["file_daemon.py"]
         )
         
         self.mcp_session = ClientSession(server_params)
@@ -25,6 +60,13 @@ class SimpleFileAgent:
         print("Доступные инструменты:")
         for tool in tools.tools:
             print(f"- {tool.name}: {tool.description}")
+
+        # Просим компактные ответы в тех форматах, что умеем разворачивать
+        # (zstd — только если установлен zstandard); старый сервер без этого
+        # инструмента просто продолжит отвечать в прежнем формате
+        if any(tool.name == "negotiate_encoding" for tool in tools.tools):
+            reply = await self.mcp_session.call_tool("negotiate_encoding", {"accept": list(FEATURES)})
+            self.encoding = json.loads(reply.content[0].text)["encoding"]
     
     async def use_mcp_tool(self, tool_name, arguments):
         """Использование инструмента MCP сервера"""
@@ -32,16 +74,37 @@ class SimpleFileAgent:
             raise Exception("MCP сервер не подключен")
         
         result = await self.mcp_session.call_tool(tool_name, arguments)
-        return result.content[0].text if result.content else "Нет результата"
+        if not result.content:
+            return "Нет результата"
+        return decode_response(tool_name, result.content[0].text, self.encoding)
     
-    def analyze_request(self, user_input):
-        """Анализ запроса пользователя для определения нужных действий"""
+    async def analyze_request(self, user_input):
+        """Анализ запроса пользователя для определения нужных действий.
+
+        Одинаковые с точностью до регистра, пробелов и пунктуации запросы
+        берутся из plan_cache без обращения к модели.
+        """
+        cached = self.plan_cache.get(user_input)
+        if cached is not None:
+            return cached
+
         system_prompt = """
         Ты помощник по работе с файлами. У тебя есть следующие инструменты:
-        - list_files: показать файлы в директории
-        - read_file: прочитать содержимое файла
-        - create_file: создать новый файл
-        - search_in_files: найти текст в файлах
+        - list_files: показать файлы в директории (depth, pattern, limit/cursor)
+        - find_files: найти файл по приблизительному имени (query, directory)
+        - read_file: прочитать содержимое файла (можно offset/length или start_line/end_line)
+        - read_file_chunk: прочитать большой файл по страницам (filepath, cursor, page_size)
+        - read_many: прочитать сразу несколько файлов (files: список путей)
+        - stat_many: узнать тип, размер и время изменения нескольких путей (paths)
+        - create_file: создать новый файл (mode: write, atomic или append)
+        - begin_upload, write_chunk, commit_upload: записать большой файл по частям
+          (offset у write_chunk — смещение части в байтах UTF-8)
+        - search_in_files: найти текст в файлах (mode: literal, regex, word, all, any; max_matches)
+        - search_results: следующая страница поиска, начатого с page_size (handle)
+        - find_duplicate_files: найти файлы с одинаковым содержимым (directory, min_size)
+        - hash_files: посчитать хэши содержимого файлов (paths, algorithm)
+        - workspace_roots, add_root: именованные корни проекта; у инструментов выше
+          есть параметр root — тогда пути задаются относительно корня
         
         Проанализируй запрос пользователя и определи:
         1. Какой инструмент нужно использовать
@@ -53,9 +116,22 @@ class SimpleFileAgent:
             "arguments": {"параметр": "значение"},
             "explanation": "объяснение действия"
         }
+        
+        Если нужно несколько действий, верни их списком шагов:
+        {
+            "steps": [
+                {"id": "a", "tool": "find_files", "arguments": {"query": "config"}},
+                {"id": "b", "tool": "search_in_files", "arguments": {"directory": ".", "search_term": "TODO"}},
+                {"id": "c", "tool": "read_file", "arguments": {"filepath": "{{a.0.file}}"}}
+            ],
+            "explanation": "объяснение действий"
+        }
+        Шаги без зависимостей выполняются одновременно. {{id}} подставляет
+        результат шага id, {{id.0.file}} — поле из его JSON; такой шаг ждёт
+        шаг id. Порядок без подстановки задаётся "depends_on": ["id"].
         """
         
-        response = self.anthropic.messages.create(
+        response = await self.anthropic.messages.create(
             model="claude-3-sonnet-20240229",
             max_tokens=500,
             system=system_prompt,
@@ -66,7 +142,9 @@ class SimpleFileAgent:
         )
         
         try:
-            return json.loads(response.content[0].text)
+            plan = json.loads(response.content[0].text)
+            self.plan_cache.put(user_input, plan)
+            return plan
         except:
             return {
                 "tool": None,
@@ -78,20 +156,45 @@ class SimpleFileAgent:
         """Обработка запроса пользователя"""
         print(f"\n🤖 Обрабатываю запрос: {user_input}")
         
+        # Очевидные команды (показать файлы, прочитать файл, найти текст)
+        # выполняются без модели: и план, и ответ строятся локально
+        routed = route(user_input)
+        if routed is not None:
+            print(f"📋 План действий: {routed['explanation']}")
+            try:
+                result = await self.use_mcp_tool(routed['tool'], routed['arguments'])
+                return format_result(routed, result)
+            except Exception as e:
+                return f"❌ Ошибка выполнения: {str(e)}"
+        
         # Анализируем запрос
-        analysis = self.analyze_request(user_input)
+        analysis = await self.analyze_request(user_input)
         print(f"📋 План действий: {analysis['explanation']}")
         
-        if analysis['tool']:
+        try:
+            steps = plan_steps(analysis)
+        except ValueError as e:
+            return f"❌ Некорректный план: {str(e)}"
+        
+        if steps:
             try:
-                # Выполняем действие через MCP
-                result = await self.use_mcp_tool(
-                    analysis['tool'], 
-                    analysis['arguments']
-                )
+                # Выполняем шаги через MCP: независимые — одновременно
+                results = await execute_plan(steps, self.use_mcp_tool)
+                
+                # Большие результаты сокращаем под бюджет токенов итогового запроса
+                results, report = compact_results(steps, results)
+                if report["tokens_saved"]:
+                    self.tokens_saved += report["tokens_saved"]
+                    print(f"✂️ Результаты сокращены: ~{report['tokens_before']} → "
+                          f"~{report['tokens_after']} токенов")
+                result = "\n\n".join(
+                    f"Шаг {step['id']} ({step['tool']} {json.dumps(step['arguments'], ensure_ascii=False)}):\n"
+                    f"{results[step['id']]}"
+                    for step in steps
+                ) if len(steps) > 1 else results[steps[0]['id']]
                 
-                # Формируем ответ пользователю
-                final_response = self.anthropic.messages.create(
+                # Формируем ответ пользователю — один вызов модели на весь план
+                final_response = await self.anthropic.messages.create(
                     model="claude-3-sonnet-20240229",
                     max_tokens=1000,
                     messages=[{
@@ -115,14 +218,56 @@ class SimpleFileAgent:
         else:
             return "❓ Не понял, что нужно сделать. Попробуйте переформулировать запрос."
 
+    async def process_many(self, requests, concurrency=REQUEST_CONCURRENCY, timeout=REQUEST_TIMEOUT):
+        """Обработать несколько запросов одновременно, не больше concurrency сразу.
+
+        Ответы возвращаются в порядке запросов. Запрос, не уложившийся
+        в timeout секунд, отменяется вместе с его обращениями к API.
+        """
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def process_one(user_input):
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(self.process_request(user_input), timeout)
+                except asyncio.TimeoutError:
+                    return f"❌ Превышено время ожидания ({timeout:g} с)"
+
+        return await asyncio.gather(*(process_one(user_input) for user_input in requests))
+
+    async def close(self):
+        """Закрыть пул соединений с API"""
+        await self.anthropic.close()
+
+async def run_batch(agent, batch_file, concurrency):
+    """Выполнить запросы из файла (по одному в строке, # — комментарий)"""
+    with open(batch_file, 'r', encoding='utf-8') as f:
+        requests = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    responses = await agent.process_many(requests, concurrency)
+    for user_input, response in zip(requests, responses):
+        print(f"\n👤 {user_input}\n🤖 {response}")
+
 # Функция для запуска агента
 async def main():
+    parser = argparse.ArgumentParser(description="AI агент для работы с файлами")
+    parser.add_argument("--batch", help="файл с запросами, по одному в строке")
+    parser.add_argument("--concurrency", type=int, default=REQUEST_CONCURRENCY,
+                        help="сколько запросов обрабатывать одновременно")
+    args = parser.parse_args()
+
     # Замените на ваш API ключ Anthropic
     agent = SimpleFileAgent("your-anthropic-api-key")
     
     print("🚀 Запускаю AI агента...")
     await agent.connect_to_mcp_server()
     
+    if args.batch:
+        try:
+            await run_batch(agent, args.batch, args.concurrency)
+        finally:
+            await agent.close()
+        return
+
     print("\n✅ Агент готов к работе!")
     print("Примеры команд:")
     print("- Покажи файлы в текущей папке")
@@ -132,18 +277,22 @@ async def main():
     
     while True:
         try:
-            user_input = input("\n👤 Ваш запрос: ")
+            # input() в отдельном потоке, чтобы не останавливать цикл событий
+            user_input = await asyncio.to_thread(input, "\n👤 Ваш запрос: ")
             if user_input.lower() in ['выход', 'quit', 'exit']:
                 break
                 
             response = await agent.process_request(user_input)
             print(f"\n🤖 Ответ: {response}")
             
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
             break
         except Exception as e:
             print(f"❌ Ошибка: {str(e)}")
     
+    await agent.close()
+    print(f"\n📊 Кэш планов: {agent.plan_cache.stats()}")
+    print(f"📊 Сэкономлено токенов на результатах: ~{agent.tokens_saved}")
     print("\n👋 До свидания!")
 
 if __name__ == "__main__":